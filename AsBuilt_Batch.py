@@ -0,0 +1,133 @@
+"""
+Batch mode of the AsBuilt Polygon tool: runs the stages for every entry of a CSV/JSON manifest of as-builts.  Like
+AsBuilt_Stages nothing in here imports arcpy, the tool runs a manifest against the layers of an .aprx and the tests
+run one against a GeoPackage.
+
+Progress goes to a JSON-lines state file after every stage that writes, so a re-run skips the finished entries and
+picks a failed one up after the last stage it completed.
+"""
+import csv
+import json
+import os
+import time
+
+import AsBuilt_Stages
+
+
+# return list of manifest entries:
+# {'source', 'date', 'wudnum', 'buffersize', 'attach', 'selections': {layer name: OID list or where clause}}
+def readManifest(manifestPath):
+    if manifestPath.lower().endswith('.json'):
+        with open(manifestPath) as manifestFile:
+            return json.load(manifestFile)
+
+    # CSV: one row per layer selection (source, date, wudnum, buffersize, attach, layer, oids, where),
+    # rows with the same source make up one entry.  OIDs are separated by ';'
+    entries = {}
+    with open(manifestPath, newline='') as manifestFile:
+        for row in csv.DictReader(manifestFile):
+            entry = entries.setdefault(row['source'], {'source': row['source'], 'date': row.get('date') or '',
+                                                       'wudnum': row.get('wudnum') or '',
+                                                       'buffersize': row.get('buffersize') or None,
+                                                       'attach': row.get('attach') or None, 'selections': {}})
+            if row.get('oids'):
+                entry['selections'][row['layer']] = [int(oid) for oid in row['oids'].split(';')]
+            else:
+                entry['selections'][row['layer']] = row.get('where') or ''
+    return list(entries.values())
+
+
+# return dict of source -> the last record earlier runs of the same manifest wrote for it
+def readBatchState(statePath):
+    state = {}
+    if os.path.exists(statePath):
+        with open(statePath) as stateFile:
+            for line in stateFile:
+                if line.strip():
+                    record = json.loads(line)
+                    state[record['source']] = record
+    return state
+
+
+# Append a record to the state file, flushed so it survives the process dying on the next stage
+def writeRecord(stateFile, record):
+    stateFile.write(json.dumps(record) + '\n')
+    stateFile.flush()
+
+
+def selectManifestFeatures(storage, layers, selections):
+    # Clear what the last entry selected, then select this entry's features by OID list or where clause
+    for layer in layers.values():
+        storage.clearSelection(layer)
+
+    for layerName, selection in selections.items():
+        if layerName not in layers:
+            raise ValueError(f"The layer '{layerName}' is not in the map.")
+        storage.select(layers[layerName], selection)
+
+
+# return dict with the number of entries ok, failed and skipped
+def runManifest(run, manifestPath, statePath, layers, abPoly, defaultBuffersize, defaultAttach, scanLayers=None):
+    # layers maps the layer names of the manifest to the layers (or datasets) the stages get.  scanLayers returns the
+    # layers to run the stages on once an entry's features are selected, by default the layers the entry selects.
+    # Each stage commits its own edit session, so a failed entry doesn't roll back the entries before it.
+    storage = run.storage
+    metrics = run.metrics
+    incrementalMode = run.incrementalMode
+
+    entries = readManifest(manifestPath)
+    state = readBatchState(statePath)
+    results = {'ok': 0, 'failed': 0, 'skipped': 0}
+    with open(statePath, 'a') as stateFile:
+        for number, entry in enumerate(entries, 1):
+            earlier = state.get(entry['source'])
+            if earlier and earlier['status'] == 'ok':
+                results['skipped'] += 1
+                continue
+
+            run.messages.AddMessage(f"[{number}/{len(entries)}] {entry['source']}")
+            entryStart = time.perf_counter()
+            metrics.reset()
+            progress = {'completed': [], 'newPolygons': []}
+            record = {'source': entry['source'], 'status': 'running', 'error': '', 'seconds': 0,
+                      'stages': metrics.stages}
+            if earlier:
+                progress = {'completed': earlier.get('completed', []), 'newPolygons': earlier.get('newPolygons', [])}
+                if 'addNewPolygons' not in progress['completed']:
+                    # The polygons may have been committed just before the last run died, merge rather than
+                    # insert them a second time
+                    run.incrementalMode = True
+                run.messages.AddMessage(f"Resuming after: {', '.join(progress['completed']) or 'nothing'}")
+
+            try:
+                run.setInputs(entry['source'], entry.get('date') or '', entry.get('wudnum') or '')
+                run.buffersize = float(entry.get('buffersize') or defaultBuffersize)
+                addAttach = int(entry['attach']) if entry.get('attach') not in (None, '') else defaultAttach
+                selectManifestFeatures(storage, layers, entry['selections'])
+                with metrics.stage('checkFeatureSelection'):
+                    if scanLayers:
+                        selLayers = scanLayers()
+                    else:
+                        selLayers = [layers[layerName] for layerName in entry['selections']]
+                AsBuilt_Stages.runStages(run, selLayers, abPoly, addAttach, progress,
+                                         lambda progress: writeRecord(stateFile, dict(record, **progress)))
+                record['status'] = 'ok'
+            except Exception as e:
+                record.update(status='failed', error=str(e))
+                run.messages.AddWarning(f"{entry['source']} failed: {record['error']}")
+            finally:
+                run.incrementalMode = incrementalMode
+
+            for line in metrics.summary():
+                run.messages.AddMessage(line)
+            if run.bufferCache:
+                record['bufferCache'] = metrics.cacheStats()
+                run.messages.AddMessage(f"Buffer cache: {record['bufferCache']['hits']:,} hits, "
+                                        f"{record['bufferCache']['misses']:,} misses")
+            record.update(progress, seconds=round(time.perf_counter() - entryStart, 2))
+            writeRecord(stateFile, record)
+            results[record['status']] += 1
+
+    run.messages.AddMessage(f"Batch finished: {results['ok']} ok, {results['failed']} failed, "
+                            f"{results['skipped']} skipped (already done).  Details in {statePath}")
+    return results
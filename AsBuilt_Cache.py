@@ -0,0 +1,78 @@
+"""
+On-disk buffer cache for the AsBuilt Polygon tool.  Buffered geometry is stored as WKB in a SQLite file, keyed by the
+layer, the feature's OID, a hash of the feature's geometry and the buffer settings, so a re-run (or an as-built that
+overlaps an earlier one) skips the geometry work for features that haven't changed.  The least recently used entries
+are evicted when the file grows past its size limit.
+"""
+import hashlib
+import sqlite3
+import time
+
+# SQLite allows 999 variables per statement in older builds
+KEYS_PER_QUERY = 500
+
+
+class BufferCache:
+
+    def __init__(self, path, maxBytes=512 * 1024 * 1024):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS buffers (key TEXT PRIMARY KEY, wkb BLOB NOT NULL, "
+                                "size INTEGER NOT NULL, lastUsed REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS buffers_lastUsed ON buffers (lastUsed)")
+
+    # return the cache key of one feature's buffer
+    @staticmethod
+    def makeKey(catalogPath, featureId, wkb, buffersize, bufferStyle):
+        style = ";".join(f"{name}={value}" for name, value in sorted(bufferStyle.items()))
+        geometryHash = hashlib.sha1(wkb).hexdigest()
+        return hashlib.sha1(f"{catalogPath.lower()}|{featureId}|{geometryHash}|{buffersize}|{style}".encode()).hexdigest()
+
+    # return dict of key -> buffered WKB for the keys found in the cache
+    def getMany(self, keys):
+        found = {}
+        for start in range(0, len(keys), KEYS_PER_QUERY):
+            chunk = keys[start:start + KEYS_PER_QUERY]
+            query = "SELECT key, wkb FROM buffers WHERE key IN ({0})".format(",".join('?' * len(chunk)))
+            found.update(self.connection.execute(query, chunk).fetchall())
+        if found:
+            now = time.time()
+            self.connection.executemany("UPDATE buffers SET lastUsed = ? WHERE key = ?", [(now, key) for key in found])
+            self.connection.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    # items is a list of (key, buffered WKB)
+    def putMany(self, items):
+        now = time.time()
+        self.connection.executemany("INSERT OR REPLACE INTO buffers VALUES (?, ?, ?, ?)",
+                                    [(key, wkb, len(wkb), now) for key, wkb in items])
+        self.connection.commit()
+        self.evict()
+
+    def evict(self):
+        # Drop the least recently used entries until the cache is back under 90% of its limit
+        totalBytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM buffers").fetchone()[0]
+        if totalBytes <= self.maxBytes:
+            return
+        target = totalBytes - int(self.maxBytes * 0.9)
+        freed = 0
+        oldKeys = []
+        for key, size in self.connection.execute("SELECT key, size FROM buffers ORDER BY lastUsed"):
+            oldKeys.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self.connection.executemany("DELETE FROM buffers WHERE key = ?", oldKeys)
+        self.connection.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hitRate': round(self.hits / total, 3) if total else 0.0}
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,276 @@
+"""
+Geometry engine for the AsBuilt Polygon tool.  Nothing in here touches arcpy, so the buffering work can be run and
+benchmarked outside of ArcGIS Pro.  Only shapely and numpy are needed; the tool imports this module when the
+buffering stage starts, not at startup.
+"""
+import concurrent.futures
+import math
+import multiprocessing
+import os
+import struct
+import sys
+
+import numpy
+import shapely
+
+WATER_TYPE_FIELDS = ['WATER', 'SEWER', 'RECLAIMED', 'RAW', 'OTHER']
+DISSOLVE_FIELDS = ['PBCWUDFILE', 'HYPERLINK', 'P56FOLDER', 'ASBUILTNO', 'ASBUILTDATE', 'WUDPROJECTNUM',
+                   'WATER', 'SEWER', 'RECLAIMED', 'RAW', 'OTHER', 'LifeCycleStatusRemoved']
+# shapely.buffer keywords.  16 segments per quarter circle is the geopandas default the tool has always buffered with
+BUFFER_STYLE = {'quad_segs': 16, 'cap_style': 'round', 'join_style': 'round'}
+# Below this many geometries the process pool startup costs more than it saves
+PARALLEL_MIN_FEATURES = 5000
+
+
+# return list of buffered shapely geometries, in the same order as geometries
+def bufferGeometries(geometries, buffersize, bufferStyle=None):
+    # Buffer every geometry of a layer in one vectorized shapely call instead of building a GeoDataFrame per feature
+    if not len(geometries):
+        return []
+    bufferStyle = bufferStyle or BUFFER_STYLE
+    buffers = shapely.buffer(geometries, int(buffersize), **bufferStyle)
+    if bufferStyle.get('cap_style') in ('flat', shapely.BufferCapStyle.flat):
+        # A flat cap ends the buffer at the vertex, a point would come out as POLYGON EMPTY.  Points keep round caps.
+        points = numpy.isin(shapely.get_type_id(geometries), [0, 4])
+        if points.any():
+            roundStyle = dict(bufferStyle, cap_style='round')
+            buffers[points] = shapely.buffer(numpy.asarray(geometries, dtype=object)[points], int(buffersize),
+                                             **roundStyle)
+    return list(buffers)
+
+
+# return array of shapely geometries from a list of WKB bytes
+def fromWkb(wkbGeometries):
+    wkbArray = numpy.empty(len(wkbGeometries), dtype=object)
+    wkbArray[:] = wkbGeometries
+    return shapely.from_wkb(wkbArray)
+
+
+# return list of buffered shapely geometries from a list of WKB bytes
+def bufferWkb(wkbGeometries, buffersize, workers=1, bufferStyle=None):
+    # Decode the whole layer in one call instead of rebuilding each shape vertex by vertex
+    workers = poolWorkers(len(wkbGeometries), workers)
+    if workers == 1:
+        return bufferGeometries(list(fromWkb(wkbGeometries)), buffersize, bufferStyle)
+
+    with processPool(workers) as pool:
+        chunks = chunked(wkbGeometries, workers)
+        results = pool.map(bufferWkbChunk, chunks, [buffersize] * len(chunks), [bufferStyle] * len(chunks))
+        return list(fromWkb([bufferedWkb for chunk in results for bufferedWkb in chunk]))
+
+
+# return list of WKB bytes for a list of shapely geometries
+def toWkb(geometries):
+    if not geometries:
+        return []
+    return list(shapely.to_wkb(geometries))
+
+
+# return the total number of vertices in a list of shapely geometries
+def countVertices(geometries):
+    if not len(geometries):
+        return 0
+    return int(shapely.get_num_coordinates(geometries).sum())
+
+
+# return the total number of vertices in a list of WKB bytes, read from the WKB headers without decoding the geometry
+def countWkbVertices(wkbGeometries):
+    # Covers the types shapely can decode (1-7), curves raise ValueError here as they would in fromWkb
+    return sum(wkbVertices(wkb, 0)[0] for wkb in wkbGeometries)
+
+
+# return (vertices, offset after the geometry) for the (ISO or extended) WKB geometry starting at offset
+def wkbVertices(wkb, offset):
+    byteOrder = '<' if wkb[offset] == 1 else '>'
+    (geometryType,) = struct.unpack_from(byteOrder + 'I', wkb, offset + 1)
+    offset += 5
+    dimensions = 2
+    if geometryType & 0x80000000:
+        dimensions += 1
+    if geometryType & 0x40000000:
+        dimensions += 1
+    if geometryType & 0x20000000:
+        offset += 4
+    geometryType &= 0x0FFFFFFF
+    dimensions += {0: 0, 1: 1, 2: 1, 3: 2}[geometryType // 1000]
+    geometryType %= 1000
+    coordinateSize = 8 * dimensions
+
+    if geometryType == 1:
+        # POINT EMPTY is written with NaN coordinates
+        (x,) = struct.unpack_from(byteOrder + 'd', wkb, offset)
+        return (0 if math.isnan(x) else 1), offset + coordinateSize
+    (count,) = struct.unpack_from(byteOrder + 'I', wkb, offset)
+    offset += 4
+    if geometryType == 2:
+        return count, offset + count * coordinateSize
+    if geometryType == 3:
+        vertices = 0
+        for ring in range(count):
+            (points,) = struct.unpack_from(byteOrder + 'I', wkb, offset)
+            vertices += points
+            offset += 4 + points * coordinateSize
+        return vertices, offset
+    if geometryType in (4, 5, 6, 7):
+        vertices = 0
+        for part in range(count):
+            partVertices, offset = wkbVertices(wkb, offset)
+            vertices += partVertices
+        return vertices, offset
+    raise ValueError(f"WKB geometry type {geometryType} is not counted from the header")
+
+
+# return bufferRows, with the water type flags shared across each HYPERLINK
+def rollupWaterTypes(bufferRows):
+    # Any 'Yes' on a water type field is shared by every buffer with the same HYPERLINK.
+    # One pass collects the flags per HYPERLINK, a second pass applies them.
+    flagsByHyperlink = {}
+    for row in bufferRows:
+        flags = flagsByHyperlink.setdefault(row['HYPERLINK'], set())
+        for field in WATER_TYPE_FIELDS:
+            if row[field] == 'Yes':
+                flags.add(field)
+
+    for row in bufferRows:
+        for field in flagsByHyperlink[row['HYPERLINK']]:
+            row[field] = 'Yes'
+
+    return bufferRows
+
+
+# return dict of DISSOLVE_FIELDS values -> list of the rows' shapeField values
+def groupByDissolveFields(rows, shapeField):
+    # Same grouping as the Dissolve GP tool (MULTI_PART)
+    groups = {}
+    for row in rows:
+        key = tuple(row[field] for field in DISSOLVE_FIELDS)
+        groups.setdefault(key, []).append(row[shapeField])
+    return groups
+
+
+# return list of dissolved rows, one per unique combination of DISSOLVE_FIELDS
+def dissolveBuffers(bufferRows):
+    # Done with shapely instead of a scratch feature class
+    return [dict(zip(DISSOLVE_FIELDS, key), **{'SHAPE@': shapely.union_all(geometries)})
+            for key, geometries in groupByDissolveFields(bufferRows, 'SHAPE@').items()]
+
+
+# return list of dissolved rows from rows that carry their unbuffered geometry as SHAPE@WKB
+def bufferDissolveWkb(rows, buffersize, workers=1, bufferStyle=None):
+    # Buffer and dissolve in one step.  With a pool every dissolve group is cut into chunks, each worker buffers and
+    # pre-unions a chunk and sends back one polygon, so the parent only merges the partial unions.
+    groups = groupByDissolveFields(rows, 'SHAPE@WKB')
+    workers = poolWorkers(len(rows), workers)
+    if workers == 1:
+        return [dict(zip(DISSOLVE_FIELDS, key),
+                     **{'SHAPE@': shapely.union_all(bufferWkb(wkbGeometries, buffersize, bufferStyle=bufferStyle))})
+                for key, wkbGeometries in groups.items()]
+
+    tasks = [(key, chunk) for key, wkbGeometries in groups.items() for chunk in chunked(wkbGeometries, workers)]
+    with processPool(workers) as pool:
+        partials = pool.map(bufferUnionWkbChunk, [chunk for key, chunk in tasks], [buffersize] * len(tasks),
+                            [bufferStyle] * len(tasks))
+        partialsByKey = {}
+        for (key, chunk), partial in zip(tasks, partials):
+            partialsByKey.setdefault(key, []).append(partial)
+    return [dict(zip(DISSOLVE_FIELDS, key), **{'SHAPE@': shapely.union_all(fromWkb(partialsByKey[key]))})
+            for key in groups]
+
+
+# return rows with their SHAPE@ simplified, topology preserved
+def simplifyRows(rows, tolerance):
+    # Tolerance is a distance, the tool ties it to the buffer size so the polygon edge moves a fraction of it at most
+    if tolerance <= 0 or not rows:
+        return rows
+    simplified = shapely.simplify([row['SHAPE@'] for row in rows], tolerance, preserve_topology=True)
+    for row, geometry in zip(rows, simplified):
+        row['SHAPE@'] = geometry
+    return rows
+
+
+# return (updatedRows, insertRows, overlappingOids) for incremental runs
+def mergeIntoExisting(newRows, existingRows, deleteMerged=False):
+    # A new polygon that intersects existing polygons of the same as-built (HYPERLINK and ASBUILTNO) is unioned into
+    # the one with the lowest OID, which takes the new row's dates and project number.  The other existing polygons
+    # it touches (a new polygon that bridges two groups joins them) are returned as overlappingOids.  With
+    # deleteMerged their shapes go into the lowest OID as well and the caller deletes them, otherwise they are left
+    # as they are.  New polygons with no such neighbor are inserted.
+    if not existingRows:
+        return [], list(newRows), []
+
+    tree = shapely.STRtree([row['SHAPE@'] for row in existingRows])
+    # owner maps an existing row to the row it is merged into, the lowest OID of each group owns itself
+    owner = {}
+    newShapes = {}
+    insertRows = []
+
+    def findOwner(index):
+        while owner.get(index, index) != index:
+            index = owner[index]
+        return index
+
+    for row in newRows:
+        candidates = [index for index in tree.query(row['SHAPE@'], predicate='intersects')
+                      if existingRows[index]['HYPERLINK'] == row['HYPERLINK']
+                      and existingRows[index]['ASBUILTNO'] == row['ASBUILTNO']]
+        if not candidates:
+            insertRows.append(row)
+            continue
+
+        groupOwners = {findOwner(index) for index in candidates}
+        target = min(groupOwners, key=lambda index: existingRows[index]['OID@'])
+        newShapes.setdefault(target, []).append(row)
+        for index in groupOwners - {target}:
+            owner[index] = target
+            newShapes[target].extend(newShapes.pop(index, []))
+
+    members = {}
+    for index in set(owner) | set(newShapes):
+        members.setdefault(findOwner(index), []).append(index)
+
+    updatedRows = []
+    overlappingOids = []
+    for target, indexes in members.items():
+        # A corrective re-run brings the current date and project number, the water types only ever get added
+        mergedRow = dict(existingRows[target])
+        mergedRow.update((field, newShapes[target][0][field]) for field in DISSOLVE_FIELDS
+                         if field not in WATER_TYPE_FIELDS)
+        mergedIndexes = indexes if deleteMerged else [target]
+        rows = [existingRows[index] for index in mergedIndexes] + newShapes[target]
+        mergedRow['SHAPE@'] = shapely.union_all([row['SHAPE@'] for row in rows])
+        for field in WATER_TYPE_FIELDS:
+            if any(row[field] == 'Yes' for row in rows):
+                mergedRow[field] = 'Yes'
+        updatedRows.append(mergedRow)
+        overlappingOids.extend(existingRows[index]['OID@'] for index in indexes if index != target)
+
+    return updatedRows, insertRows, sorted(overlappingOids)
+
+
+# return the number of processes to use for count geometries, 1 means run serially
+def poolWorkers(count, workers):
+    if not workers or workers <= 1 or count < PARALLEL_MIN_FEATURES:
+        return 1
+    return min(int(workers), os.cpu_count() or 1)
+
+
+# return items split into at most chunks lists of about the same size
+def chunked(items, chunks):
+    size = -(-len(items) // chunks)
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def processPool(workers):
+    # Inside ArcGIS Pro sys.executable is ArcGISPro.exe, the worker processes have to be started with python.exe
+    if os.path.basename(sys.executable).lower() == 'arcgispro.exe':
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+
+# Worker functions, geometry goes in and out of the worker processes as WKB
+def bufferWkbChunk(wkbGeometries, buffersize, bufferStyle=None):
+    return toWkb(bufferWkb(wkbGeometries, buffersize, bufferStyle=bufferStyle))
+
+
+def bufferUnionWkbChunk(wkbGeometries, buffersize, bufferStyle=None):
+    return shapely.union_all(bufferWkb(wkbGeometries, buffersize, bufferStyle=bufferStyle)).wkb
@@ -0,0 +1,131 @@
+"""
+Run instrumentation for the AsBuilt Polygon tool.  Records wall time, row and vertex counts, how far each stage
+raised the memory high-water mark, the change in resident memory and the storage cursor/edit session counters per
+stage, for the tool messages and an optional JSON report.
+"""
+import contextlib
+import datetime
+import json
+import os
+import sys
+import time
+
+
+# return the peak resident memory of this process so far in bytes, or None if it can't be read
+def peakRssBytes():
+    try:
+        import psutil
+        memoryInfo = psutil.Process().memory_info()
+        # peak_wset is the Windows peak working set, other platforms only have the current rss in psutil
+        if hasattr(memoryInfo, 'peak_wset'):
+            return memoryInfo.peak_wset
+    except ImportError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+# return the current resident memory of this process in bytes, or None if it can't be read
+def rssBytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class RunMetrics:
+    # One record per stage, stages can be nested ('createBuffers.buffer')
+
+    def __init__(self, counters=None):
+        # counters is a dict of running totals owned by the storage backend (cursors opened, edit sessions)
+        self.counters = counters if counters is not None else {}
+        self.reset()
+
+    def reset(self):
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self.stages = []
+        self.openStages = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        # Entering a stage again (once per layer, say) adds to the same record
+        if self.openStages:
+            name = f"{self.openStages[-1]['stage']}.{name}"
+        record = next((record for record in self.stages if record['stage'] == name), None)
+        if record is None:
+            record = {'stage': name, 'seconds': 0.0, 'rows': 0, 'vertices': 0}
+            self.stages.append(record)
+        self.openStages.append(record)
+        countersBefore = dict(self.counters)
+        rssBefore = rssBytes()
+        peakBefore = peakRssBytes()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(record['seconds'] + time.perf_counter() - start, 3)
+            for key, value in self.counters.items():
+                record[key] = record.get(key, 0) + value - countersBefore.get(key, 0)
+            # The process peak covers the whole ArcGIS Pro session, what a stage adds to it is how far it pushed the
+            # high-water mark.  A stage that allocates and frees 2 GB shows up here even though rssDeltaMB is about 0.
+            peakAfter = peakRssBytes()
+            if peakBefore is not None and peakAfter is not None:
+                record['peakRiseMB'] = round(record.get('peakRiseMB', 0) + (peakAfter - peakBefore) / 1048576, 1)
+            # Memory the stage still holds when it ends (or gave back, if negative), GEOS allocations included
+            rssAfter = rssBytes()
+            if rssBefore is not None and rssAfter is not None:
+                record['rssDeltaMB'] = round(record.get('rssDeltaMB', 0) + (rssAfter - rssBefore) / 1048576, 1)
+            self.openStages.pop()
+
+    # Add to a count of the innermost open stage
+    def count(self, key, amount=1):
+        if self.openStages:
+            record = self.openStages[-1]
+            record[key] = record.get(key, 0) + amount
+
+    # return the sum of a count() key over the stages of this run
+    def total(self, key):
+        # count() adds to the innermost stage only, so nested stages aren't counted twice.  Not for the storage
+        # counters, those are added to every open stage.
+        return sum(record.get(key, 0) for record in self.stages)
+
+    # return dict of the buffer cache hits and misses of this run
+    def cacheStats(self):
+        hits, misses = self.total('cacheHits'), self.total('cacheMisses')
+        return {'hits': hits, 'misses': misses, 'hitRate': round(hits / (hits + misses), 3) if hits + misses else 0.0}
+
+    # return the summary as message lines
+    def summary(self):
+        lines = ["Stage timings:"]
+        for record in self.stages:
+            indent = '  ' * record['stage'].count('.')
+            details = [f"{record['seconds']:.2f} s"]
+            for key in record:
+                if key not in ('stage', 'seconds', 'peakRiseMB', 'rssDeltaMB') and record[key]:
+                    details.append(f"{record[key]:,} {key}")
+            if record.get('peakRiseMB') is not None:
+                details.append(f"peak +{record['peakRiseMB']:,} MB")
+            if record.get('rssDeltaMB') is not None:
+                details.append(f"{record['rssDeltaMB']:+,} MB resident")
+            lines.append(f"  {indent}{record['stage'].split('.')[-1]}: {', '.join(details)}")
+        return lines
+
+    def asDict(self):
+        return {'started': self.started, 'stages': self.stages}
+
+    def writeJson(self, path, **extra):
+        report = self.asDict()
+        report.update(extra)
+        with open(path, 'w') as reportFile:
+            json.dump(report, reportFile, indent=2)
@@ -2,22 +2,146 @@
 This code is used in the AsBuilt Polygon tool for ArcGIS Pro.  It automates the creation of the polygons around selected
 Points and Lines.  It also completes the Source and AsBuilt Date fields with values the user provides.
 """
-import arcpy
+import argparse
+import hashlib
+import json
 import os
 import sys
-from shapely.geometry import Point, Polygon, LineString
-import geopandas
-
-arcpy.SetLogMetadata(False)
-arcpy.SetLogHistory(False)
-arcpy.env.overwriteOutput = True
-arcpy.env.addOutputsToMap = False
+import time
+import AsBuilt_Batch
+import AsBuilt_Cache
+import AsBuilt_Metrics
+import AsBuilt_Stages
+import AsBuilt_Storage
+
+# arcpy, storage and metrics are set up by setUpArcpy in __main__.  Process pool workers start by spawn on Windows
+# and import this script again as __mp_main__, nothing at module level may import arcpy or check out a license.
+arcpy = None
+# All reads and writes of the stages go through storage, see AsBuilt_Storage
+storage = None
+# Stage timings and counts of the current run, see AsBuilt_Metrics
+metrics = None
 # sys.tracebacklimit = 0
 
+
+def setUpArcpy():
+    global arcpy, storage, metrics
+    import arcpy
+    arcpy.SetLogMetadata(False)
+    arcpy.SetLogHistory(False)
+    arcpy.env.overwriteOutput = True
+    arcpy.env.addOutputsToMap = False
+    storage = AsBuilt_Storage.ArcpyStorage()
+    metrics = AsBuilt_Metrics.RunMetrics(storage.counters)
+
+# return the value of a tool parameter, or default when the tool was not given that parameter
+def getOptionalParameter(index, default):
+    # Parameters added after the original five may not exist on older copies of the tool
+    if index >= arcpy.GetArgumentCount():
+        return default
+    value = arcpy.GetParameter(index)
+    return default if value is None or value == '' else value
+
+
+# Layer scan caches.  workspaceVersions lives for one run, layerEligibility (the field check per catalog path, with a
+# fingerprint of the field names it saw) can be persisted between runs in the same project with saveLayerCache.
+# Entries loaded from the file are not trusted for a layer the user selected, see verifyLayerFields.
+workspaceVersions = {}
+layerEligibility = {}
+verifiedPaths = set()
+scanStats = {'describeCalls': 0, 'describeAvoided': 0}
+REQUIRED_FIELDS = ['SOURCE', 'ASBUILTDATE', 'WATERTYPE']
+
+
+def loadLayerCache(cachePath):
+    if os.path.exists(cachePath):
+        try:
+            with open(cachePath) as cacheFile:
+                # Entries of older cache files have no fingerprint, those layers are checked again
+                layerEligibility.update((path, entry) for path, entry in json.load(cacheFile).items()
+                                        if isinstance(entry, dict))
+        except (OSError, ValueError):
+            arcpy.AddWarning(f"Could not read the layer cache {cachePath}, all layers will be checked.")
+
+
+def saveLayerCache(cachePath):
+    try:
+        with open(cachePath, 'w') as cacheFile:
+            json.dump(layerEligibility, cacheFile, indent=2)
+    except OSError:
+        arcpy.AddWarning(f"Could not write the layer cache {cachePath}.")
+
+
+# return the catalog path of a map layer
+def layerCatalogPath(lyr):
+    # The layer's data source is the catalog path for feature classes, no Describe needed
+    if lyr.supports('DATASOURCE'):
+        return lyr.dataSource
+    scanStats['describeCalls'] += 1
+    return arcpy.Describe(lyr).catalogPath
+
+
+# return the version of an .sde connection, or None if it can't be described
+def workspaceVersion(workspace):
+    # Many layers share one .sde connection, only Describe it once
+    if workspace in workspaceVersions:
+        scanStats['describeAvoided'] += 1
+    else:
+        scanStats['describeCalls'] += 1
+        try:
+            workspaceVersions[workspace] = arcpy.Describe(workspace).connectionProperties.version
+        except (AttributeError, OSError):
+            workspaceVersions[workspace] = None
+    return workspaceVersions[workspace]
+
+
+# return the fingerprint of a layer's field names that layerEligibility keeps
+def fieldsFingerprint(fieldNames):
+    return hashlib.sha1(";".join(sorted(field.upper() for field in fieldNames)).encode()).hexdigest()
+
+
+# return the layerEligibility entry of a layer from its fields as they are now
+def checkLayerFields(descPath, lyr):
+    scanStats['describeCalls'] += 1
+    try:
+        fcFields = [f.name for f in arcpy.ListFields(lyr)]
+    except (AttributeError, OSError):
+        fcFields = []
+    layerEligibility[descPath] = {'fields': fieldsFingerprint(fcFields),
+                                  'eligible': all(field in fcFields for field in REQUIRED_FIELDS)}
+    verifiedPaths.add(descPath)
+    return layerEligibility[descPath]
+
+
+# return True if the dataset has the fields and location the tool edits
+def isEligibleDataset(descPath, lyr):
+    if 'rest/services/' in descPath or not any(item in descPath for item in ['wud.sewerstormwater',
+                                                                              'wud.waterdistribution']):
+        return False
+    if descPath in layerEligibility:
+        scanStats['describeAvoided'] += 1
+        return layerEligibility[descPath]['eligible']
+    return checkLayerFields(descPath, lyr)['eligible']
+
+
+# return True if a selected layer whose eligibility came from the cache file still has the fields the tool edits
+def verifyLayerFields(descPath, lyr):
+    # Only the selected layers are checked again, a handful instead of every layer of the map.  Fields added to or
+    # dropped from a layer since the cache was saved show up as a different fingerprint.
+    cachedFields = layerEligibility[descPath]['fields']
+    scanStats['describeAvoided'] -= 1
+    entry = checkLayerFields(descPath, lyr)
+    if entry['fields'] != cachedFields:
+        arcpy.AddMessage(f"The fields of '{lyr.longName}' changed since the layer cache was saved, it was checked again.")
+    return entry['eligible']
+
+
 # return selLayers
 def checkFeatureSelection():
     print("Checking Production layers.")
     # arcpy.AddMessage("Checking Production layers.")
+    scanStart = time.perf_counter()
+    scanStats.update(describeCalls=0, describeAvoided=0)
 
     # Get list of all feature Layers
     mapLayers = []
@@ -29,54 +153,52 @@ def checkFeatureSelection():
                     if sublayer.visible:
                         if sublayer.isFeatureLayer:
                             print(f"The layer '{sublayer.longName}' is visible.")
-                            mapLayers.append(sublayer.longName)
+                            mapLayers.append(sublayer)
             try:
                 if lyr.isGroupLayer and lyr.parentGroup:
                     if lyr.isFeatureLayer:
                         print(f"The layer '{lyr.longName}' is visible.")
-                        mapLayers.append(lyr.longName)
+                        mapLayers.append(lyr)
             except AttributeError:
                 continue
             if lyr.isFeatureLayer:
                 print(f"The layer '{lyr.longName}' is visible.")
-                mapLayers.append(lyr.longName)
+                mapLayers.append(lyr)
 
     # Remove from list if it matches any of the criteria below:
+    descPaths = {}
     for each in mapLayers[:]:
         remove = False
         try:
-            desc = arcpy.Describe(each)
-            descPath = str(desc.catalogPath.lower())
-            workspace = descPath.split('.sde')[0] + '.sde'
-            descWS = arcpy.Describe(workspace)
-            cp = descWS.connectionProperties
-            fcFields = [f.name for f in arcpy.ListFields(each)]
-            if cp.version == 'sde.DEFAULT':
-                remove = True
-            if 'SOURCE' not in fcFields:
-                remove = True
-            if 'ASBUILTDATE' not in fcFields:
-                remove = True
-            if all(item not in descPath for item in ['wud.sewerstormwater', 'wud.waterdistribution']):
-                remove = True
-            if 'rest/services/' in descPath:
-                remove = True
-            if "WATERTYPE" not in fcFields:
+            descPath = descPaths[each.longName] = str(layerCatalogPath(each).lower())
+            if not isEligibleDataset(descPath, each):
+                # A layer the cache file calls ineligible may have been given the fields since, if the user
+                # selected it, look again
+                remove = (descPath not in layerEligibility or descPath in verifiedPaths or not each.getSelectionSet()
+                          or not verifyLayerFields(descPath, each))
+            if not remove and workspaceVersion(descPath.split('.sde')[0] + '.sde') in (None, 'sde.DEFAULT'):
                 remove = True
         except (AttributeError, OSError):
             remove = True
         if remove:
             mapLayers.remove(each)
 
-    # Get a list of selected layers:
+    # Get a list of selected layers, only the layers that passed are checked.  The stages get the layer objects:
+    # outside ArcGIS Pro a layer name only resolves against the 'CURRENT' project, and the cursors on the layer
+    # object honor its selection either way
     selLayers = []
     for lyr in mapLayers:
-        desclayer = arcpy.Describe(lyr)
-        if desclayer.FIDset != '':
-            if lyr not in selLayers:
+        if lyr.getSelectionSet():
+            descPath = descPaths[lyr.longName]
+            if descPath not in verifiedPaths and not verifyLayerFields(descPath, lyr):
+                continue
+            if lyr.longName not in [selLayer.longName for selLayer in selLayers]:
                 # featureCount = len(desc.FIDSet.split(";"))
                 selLayers.append(lyr)
 
+    arcpy.AddMessage(f"Layer scan: {scanStats['describeCalls']} Describe/ListFields calls, "
+                     f"{scanStats['describeAvoided']} avoided, {time.perf_counter() - scanStart:.2f} s.")
+
     if not selLayers:
         raise ValueError("Make sure at least 1 feature is selected is selected or check if you are using"
                          "'Default' data; this tool is intended for versioned data.")
@@ -86,292 +208,52 @@ def checkFeatureSelection():
         print("Production layers selected.")
         # arcpy.AddMessage("Production layers selected.")
 
-    arcpy.AddMessage(selLayers)
+    arcpy.AddMessage([lyr.longName for lyr in selLayers])
     return selLayers
 
 
-def updateSelected(selLayers):
-
-    print("Populating SOURCE and ASBUILTDATE fields for selected features.")
-    arcpy.AddMessage("Populating SOURCE and ASBUILTDATE fields for selected features.")
-    # Fill out SOURCE and ASBUILTDATE fields for the selected features
-    # (this step is not for the as-built polygons, thats later)
-    selDesc = arcpy.Describe(selLayers[0])
-    workspace = os.path.dirname(selDesc.catalogPath)
-    desc = arcpy.Describe(workspace)
-    if hasattr(desc, "datasetType") and desc.datasetType == 'FeatureDataset':
-        workspace = os.path.dirname(workspace)
-    with arcpy.da.Editor(workspace, multiuser_mode=selDesc.isVersioned):
-        for eachlayer in selLayers:
-            # desc = arcpy.Describe(eachlayer)
-            # FID = desc.FIDSet
-            # if FID:
-            with arcpy.da.UpdateCursor(eachlayer, ['SOURCE', 'ASBUILTDATE']) as cursor:
-                for row in cursor:
-                    if row[0] != r"{}".format(hyperlink) or row[1] != asbuiltDate:
-                        row[0] = r"{}".format(hyperlink)
-                        row[1] = asbuiltDate
-                        cursor.updateRow(row)
-
-
-# return dissolvedBuffer, asBuiltBuffers
-def createBuffers(selLayers):
-
-    arcpy.env.workspace = aprx.defaultGeodatabase
-    workspace = arcpy.env.workspace
-    # workspace = arcpy.env.scratchGDB
-    # arcpy.env.scratchWorkspace = workspace
-
-    asbuiltNo = os.path.splitext(os.path.basename(pbcwudfile))[0][0:7]
-    p56 = hyperlink.split("\\")[2]
-    # if the 5th position is an underscore, it's an assumed asbuilt number
-    if pbcwudfile[4] == '_':
-        # get first 4 characters of filename
-        asbuiltNo = os.path.splitext(os.path.basename(pbcwudfile))[0][0:4]
-
-
-    fields = ['PBCWUDFILE', 'HYPERLINK', 'P56FOLDER', 'ASBUILTNO', 'ASBUILTDATE',
-              'WUDPROJECTNUM', 'WATER', 'SEWER', 'RECLAIMED', 'RAW', 'OTHER',
-              'LifeCycleStatusRemoved', 'SHAPE@']
-
-    # Create asBuiltBuffers:
-    print("Checking if asBuiltBuffer layer exists.  If it does, clear the table.")
-    asBuiltBuffers = arcpy.CreateFeatureclass_management(workspace, "asBuiltBuffers", 'POLYGON', lyrdescPath,
-                                                         'SAME_AS_TEMPLATE', 'SAME_AS_TEMPLATE', '2236')
-
-    print("Creating Buffers for the selected features:")
-    with arcpy.da.Editor(workspace, multiuser_mode=False):
-        for each in selLayers:
-            desc = arcpy.Describe(each)
+# return abPoly, lyrdescPath, lyrworkspace
+def findAsBuiltPolygons(lyrList):
+    for lyr in lyrList:
+        if lyr.isFeatureLayer:
             try:
-                FID = desc.FIDSet
-            except():
+                lyrdesc = arcpy.Describe(lyr)
+                if lyrdesc.Name == 'wGISRef.WUD.Asbuilt_Polygons':
+                    lyrdescPath = lyrdesc.catalogPath
+                    lyrworkspace = lyrdescPath.split('.sde')[0] + '.sde'
+                    lyrdescWS = arcpy.Describe(lyrworkspace)
+                    lyrcp = lyrdescWS.connectionProperties
+                    # arcpy.AddMessage(lyrdescPath)
+                    if (lyrcp.server).lower() == 'gisagl' and (lyrcp.database).lower() == 'wgisref':  # if (lyrcp.version).lower() != 'sde.default'
+                        # arcpy.AddMessage("Found As-Built Polygon layer")
+                        print("Found As-Built Polygon layer")
+                        return lyr, lyrdescPath, lyrworkspace
+            except (OSError, AttributeError):
                 continue
-            if FID:
-                print("Making buffer for: {}".format(each))  # desc.name
-                arcpy.AddMessage("Making buffer for: {}".format(each))  # desc.name
-                sqlquery = "OBJECTID IN ({0})".format(FID.replace(';', ','))
-                fieldsWaterType = {"WATER": "Potable", "SEWER": "Sewage", "RECLAIMED": "Reclaimed", "RAW": "Raw",
-                                   "OTHER": "Treated"}
-                if desc.shapeType == 'Polyline':
-                    insertCursor = arcpy.da.InsertCursor(asBuiltBuffers, fields)
-                    with arcpy.da.SearchCursor(each, ["WATERTYPE", "SHAPE@"],
-                                               where_clause=sqlquery) as search_cursor:
-                        for row in search_cursor:
-                            lineCoords = []
-                            for vert in row[1]:
-                                for coord in vert:
-                                    lineCoords.append((coord.X, coord.Y))
-                                gisLine = [LineString(lineCoords)]
-                            lineBuffer = {'PBCWUDFILE': pbcwudfile, 'HYPERLINK': hyperlink,
-                                           'P56FOLDER': p56, 'ASBUILTNO': asbuiltNo,
-                                           'ASBUILTDATE': asbuiltDate, 'WUDPROJECTNUM': asbuiltWUDNUM,
-                                           'WATER': 'No', 'SEWER': 'No',
-                                           'RECLAIMED': 'No', 'RAW': 'No', 'OTHER': 'No',
-                                           'LifeCycleStatusRemoved': 'No', 'SHAPE@': gisLine}
-                            lineDict = {"WATERTYPE": row[0], "Shape": row[1]}
-                            waterTypeDict = {}
-                            for output_field, input_value in fieldsWaterType.items():
-                                waterTypeDict[output_field] = "Yes" if lineDict["WATERTYPE"] == input_value else "No"
-                            for key, value in waterTypeDict.items():
-                                if value == 'Yes':
-                                    for att, values in lineBuffer.items():
-                                        if att == key:
-                                            lineBuffer[att] = 'Yes'
-
-                            gdf = geopandas.GeoDataFrame(lineBuffer, geometry='SHAPE@', crs='EPSG:2236')
-                            gdf['SHAPE@'] = gdf['SHAPE@'].buffer(int(buffersize))
-
-                            bufferCoords = gdf['SHAPE@'].apply(
-                                lambda geom: list(geom.exterior.coords) if geom.is_empty is False else [])
-                            for idx, coordList in enumerate(bufferCoords):
-                                bufferPoly = Polygon(coordList)
-
-                            lineBuffer['SHAPE@'] = coordList
-
-                            rowValues = [lineBuffer[field] for field in fields]
-                            insertCursor.insertRow(rowValues)
-
-                if desc.shapeType == 'Point':
-                    insertCursor = arcpy.da.InsertCursor(asBuiltBuffers, fields)
-                    with arcpy.da.SearchCursor(each, ["WATERTYPE", "SHAPE@XY"],
-                                               where_clause=sqlquery) as search_cursor:
-                        for row in search_cursor:
-                            pointBuffer = {'PBCWUDFILE': pbcwudfile, 'HYPERLINK': hyperlink,
-                                           'P56FOLDER': p56, 'ASBUILTNO': asbuiltNo,
-                                           'ASBUILTDATE': asbuiltDate, 'WUDPROJECTNUM': asbuiltWUDNUM,
-                                           'WATER': 'No', 'SEWER': 'No',
-                                           'RECLAIMED': 'No', 'RAW': 'No', 'OTHER': 'No',
-                                           'LifeCycleStatusRemoved': 'No', 'SHAPE@': [Point([row[1]])]}
-                            pointDict = {"WATERTYPE": row[0], "Shape": row[1]}
-                            waterTypeDict = {}
-                            for output_field, input_value in fieldsWaterType.items():
-                                waterTypeDict[output_field] = "Yes" if pointDict["WATERTYPE"] == input_value else "No"
-                            for key, value in waterTypeDict.items():
-                                if value == 'Yes':
-                                    for att, values in pointBuffer.items():
-                                        if att == key:
-                                            pointBuffer[att] = 'Yes'
-
-                            gdf = geopandas.GeoDataFrame(pointBuffer, geometry='SHAPE@', crs='EPSG:2236')
-                            gdf['SHAPE@'] = gdf['SHAPE@'].buffer(int(buffersize))
-                            arcpy.AddMessage(gdf)
-
-                            bufferCoords = gdf['SHAPE@'].apply(
-                                lambda geom: list(geom.exterior.coords) if geom.is_empty is False else [])
-                            for idx, coordList in enumerate(bufferCoords):
-                                bufferPoly = Polygon(coordList)
-
-                            pointBuffer['SHAPE@'] = coordList
-
-                            rowValues = [pointBuffer[field] for field in fields]
-                            insertCursor.insertRow(rowValues)
-
-                else:
-                    pass
-
-        print("Populating other required fields for buffer.")
-        # Go through all the polygons, if their hyperlink is the same, update their 'watertype' fields to share 'Yes' values
-        with arcpy.da.SearchCursor(asBuiltBuffers,
-                                   ['HYPERLINK', 'SHAPE@', 'WATER', 'SEWER', 'RECLAIMED', 'RAW', 'OTHER']) as bufferList:
-            for buffer in bufferList:
-                keyBuffer = buffer[0]
-                if buffer[2] == 'Yes' and buffer[3] == 'Yes':
-                    pass
-                else:
-                    if "'" in keyBuffer:
-                        sqlQuery1 = """HYPERLINK = '{}'""".format(keyBuffer.replace("'", "''"))
-                    else:
-                        sqlQuery1 = """HYPERLINK = '{}'""".format(keyBuffer)
-                    print("Populating buffer {}".format(keyBuffer))
-                    sel_values = []
-                    try:
-                        with arcpy.da.SearchCursor(asBuiltBuffers,
-                                                   ['OBJECTID', 'HYPERLINK', 'WATER', 'SEWER', 'RECLAIMED', 'RAW', 'OTHER'],
-                                                   sqlQuery1) as cursor:
-                            for row in cursor:
-                                if row not in sel_values:
-                                    sel_values.append(row)
-
-                                checkListWater = []
-                                checkListSewer = []
-                                checkListReclaimed = []
-                                checkListRaw = []
-                                checkListOther = []
-                                for eachType in sel_values:
-                                    if eachType[2] == 'Yes':
-                                        checkListWater.append('Yes')
-                                    if eachType[3] == 'Yes':
-                                        checkListSewer.append('Yes')
-                                    if eachType[4] == 'Yes':
-                                        checkListReclaimed.append('Yes')
-                                    if eachType[5] == 'Yes':
-                                        checkListRaw.append('Yes')
-                                    if eachType[6] == 'Yes':
-                                        checkListOther.append('Yes')
-                                # print(checkListWater, checkListSewer)
-                        with arcpy.da.UpdateCursor(asBuiltBuffers, ['WATER', 'SEWER', 'RECLAIMED', 'RAW', 'OTHER'],
-                                                   sqlQuery1) as cursor1:
-                            for each1 in cursor1:
-                                if checkListWater:
-                                    each1[0] = 'Yes'
-                                    cursor1.updateRow(each1)
-                                if checkListSewer:
-                                    each1[1] = 'Yes'
-                                    cursor1.updateRow(each1)
-                                if checkListReclaimed:
-                                    each1[2] = 'Yes'
-                                    cursor1.updateRow(each1)
-                                if checkListRaw:
-                                    each1[3] = 'Yes'
-                                    cursor1.updateRow(each1)
-                                if checkListOther:
-                                    each1[4] = 'Yes'
-                                    cursor1.updateRow(each1)
-
-                    except():
-                        pass
-
-    print("Dissolving Buffers")
-    dissolvedBufferPath = workspace + "\\asBuiltBuffer_dissolved"
-
-    dissolvedBuffer = arcpy.management.Dissolve(asBuiltBuffers, dissolvedBufferPath,
-                                                "PBCWUDFILE;HYPERLINK;P56FOLDER;ASBUILTNO;ASBUILTDATE;WUDPROJECTNUM;"
-                                                "WATER;SEWER;RECLAIMED;RAW;OTHER;LifeCycleStatusRemoved",
-                                                None, "MULTI_PART", "DISSOLVE_LINES", '')
-
-    del insertCursor
-
-    return dissolvedBuffer
-
-
-def addNewPolygons(dissolvedBuffer, abPoly):
-
-    arcpy.env.addOutputsToMap = True
-    abDesc = arcpy.Describe(abPoly)
-    arcpy.AddMessage("Adding new polygons.")
-    workspace = os.path.dirname(arcpy.Describe(abPoly).catalogPath)
-    desc = arcpy.Describe(workspace)
-    if hasattr(desc, "datasetType") and desc.datasetType == 'FeatureDataset':
-        workspace = os.path.dirname(workspace)
-    with arcpy.da.Editor(workspace, multiuser_mode=abDesc.isVersioned):
-        lstFields = [field.name for field in arcpy.ListFields(dissolvedBuffer) if field.name not in ['SHAPE_Length', 'SHAPE_Area']]
-        lstFields.append('SHAPE@')
-        targetCursor = arcpy.da.InsertCursor(abPoly, lstFields)
-
-        with arcpy.da.SearchCursor(dissolvedBuffer, lstFields) as cursor:
-            for row in cursor:
-                targetCursor.insertRow(row)
-        del targetCursor
-
-    del dissolvedBuffer
-
-
-def addAttachment():
-
-    # Get the ID of the new polygon (work is done in version so no worry of conflict)
-    # This part only searches the last row, minimizing time spent
-    # with arcpy.da.SearchCursor(abPoly, ["OID@", "GLOBALID"], sql_clause=(None, 'ORDER BY OBJECTID DESC')) as cursor:
-    #     newAbPolyID = cursor.next()
-    dataSource = lambda abPoly: arcpy.Describe(abPoly).catalogPath
-    with arcpy.da.SearchCursor(dataSource(abPoly), ["OID@", "GLOBALID"], sql_clause=(None, 'ORDER BY created_date DESC')) as cur:
-        newAbPolyID = cur.next()
-
-    print(newAbPolyID)
-
-    # arr = arcpy.da.FeatureClassToNumPyArray(abPoly, ["OID@", "GLOBALID"])
-
-    arcpy.env.workspace = lyrworkspace
-
-    arcpy.AddMessage(newAbPolyID[0])
-    arcpy.AddMessage(newAbPolyID[1])
-
-    abDesc = arcpy.Describe(abPoly)
-    arcpy.AddMessage("Adding attachments.")
-    workspace = os.path.dirname(arcpy.Describe(abPoly).catalogPath)
-    desc = arcpy.Describe(workspace)
-    if hasattr(desc, "datasetType") and desc.datasetType == 'FeatureDataset':
-        workspace = os.path.dirname(workspace)
-    with arcpy.da.Editor(workspace, multiuser_mode=abDesc.isVersioned):
-        sqlquery = f"OBJECTID = {newAbPolyID[0]}"
-        with arcpy.da.InsertCursor(f"{abDesc.Name}__ATTACH",
-                                   ["DATA", "ATT_NAME", "ATTACHMENTID", "REL_GLOBALID"]) as cursor:
-            with open(asbuiltSourceRaw, 'rb') as file:
-                binary_data = file.read()
-                cursor.insertRow([binary_data, pbcwudfile, newAbPolyID[0], newAbPolyID[1]])
+
+    raise ValueError("An Asbuilt Polygons layer from the GISagl_wGISRef database is not in the current map.  "
+                     "If it is in the map, make sure it is NOT the Default version.  "
+                     "Also, to avoid another versioning error, the layers you want to modify must be versioned.")
 
 
 def do_stuff():
 
     if selLayers:
 
-        updateSelected(selLayers)
-        dissolvedBuffer = createBuffers(selLayers)
-        addNewPolygons(dissolvedBuffer, abPoly)
-        if addAttach == 1:
-            addAttachment()
-        # Refresh the layer
-        arcpy.management.ApplySymbologyFromLayer(abPoly, abPoly, update_symbology="MAINTAIN")
+        try:
+            # The stages themselves are in AsBuilt_Stages
+            AsBuilt_Stages.runStages(run, selLayers, abPoly, addAttach)
+        finally:
+            # Report even when a stage fails, that's when the timings are needed most
+            for line in metrics.summary():
+                arcpy.AddMessage(line)
+            # This run's hits and misses, the cache object keeps counting for as long as it is open
+            cacheStats = metrics.cacheStats() if run.bufferCache else None
+            if cacheStats:
+                arcpy.AddMessage(f"Buffer cache: {cacheStats['hits']:,} hits, {cacheStats['misses']:,} misses")
+            if reportPath:
+                metrics.writeJson(reportPath, hyperlink=run.hyperlink, layers=[lyr.longName for lyr in selLayers],
+                                  bufferCache=cacheStats)
 
     else:
         arcpy.AddMessage("Nothing selected")
@@ -379,56 +261,110 @@ def do_stuff():
 
 
 
-if __name__ == '__main__':
-
+if __name__ == '__main__' and '--manifest' in sys.argv:
+
+    # Headless batch mode: python AsBuilt_Polygons_Tool_wAttachments.py --manifest asbuilts.csv --project wud.aprx
+    parser = argparse.ArgumentParser(description="Create as-built polygons for every entry of a CSV/JSON manifest.")
+    parser.add_argument('--manifest', required=True, help="CSV or JSON manifest of as-builts")
+    parser.add_argument('--project', required=True, help="ArcGIS Pro project (.aprx) with the production layers")
+    parser.add_argument('--map', help="map in the project, defaults to the first map")
+    parser.add_argument('--state', help="resume file, defaults to <manifest>.state.jsonl")
+    parser.add_argument('--buffersize', type=float, default=10, help="buffer size (feet) for entries without one")
+    parser.add_argument('--attach', type=int, default=1, help="1 to add the as-built as an attachment")
+    parser.add_argument('--in-memory-dissolve', action='store_true')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--incremental', action='store_true',
+                        help="merge into the existing polygons of each as-built instead of adding new ones")
+    parser.add_argument('--delete-merged', action='store_true',
+                        help="with --incremental, delete the polygons of an as-built that get merged into another one")
+    parser.add_argument('--quad-segs', type=int, default=16, help="buffer segments per quarter circle")
+    parser.add_argument('--cap-style', choices=['round', 'flat', 'square'], default='round')
+    parser.add_argument('--join-style', choices=['round', 'mitre', 'bevel'], default='round')
+    parser.add_argument('--simplify', type=float, default=0,
+                        help="simplify the polygons with a tolerance of this fraction of the buffer size, 0 is off")
+    parser.add_argument('--layer-cache', action='store_true', help="keep the layer scan cache in the project folder")
+    parser.add_argument('--buffer-cache', help="SQLite file to keep buffered geometry in between runs")
+    parser.add_argument('--buffer-cache-mb', type=int, default=512, help="size limit of the buffer cache")
+    args = parser.parse_args()
+    setUpArcpy()
+
+    bufferCache = None
+    if args.buffer_cache:
+        bufferCache = AsBuilt_Cache.BufferCache(args.buffer_cache, args.buffer_cache_mb * 1048576)
+
+    aprx = arcpy.mp.ArcGISProject(args.project)
+    currentMap = aprx.listMaps(args.map)[0] if args.map else aprx.listMaps()[0]
+    lyrList = currentMap.listLayers()
+    abPoly, lyrdescPath, lyrworkspace = findAsBuiltPolygons(lyrList)
+
+    run = AsBuilt_Stages.AsBuiltRun(storage, arcpy, metrics, scratchWorkspace=aprx.defaultGeodatabase,
+                                    template=lyrdescPath, inMemoryDissolve=args.in_memory_dissolve,
+                                    workers=args.workers, incrementalMode=args.incremental,
+                                    bufferStyle={'quad_segs': args.quad_segs, 'cap_style': args.cap_style,
+                                                 'join_style': args.join_style},
+                                    simplifyFactor=args.simplify, bufferCache=bufferCache,
+                                    deleteMerged=args.delete_merged)
+
+    # The manifest names the layers, the stages get the layer objects of the project's map
+    layers = {lyr.longName: lyr for lyr in lyrList if lyr.isFeatureLayer}
+    layerCachePath = os.path.join(aprx.homeFolder, 'AsBuilt_layerCache.json')
+    if args.layer_cache:
+        loadLayerCache(layerCachePath)
     try:
+        AsBuilt_Batch.runManifest(run, args.manifest, args.state or args.manifest + '.state.jsonl', layers, abPoly,
+                                  args.buffersize, args.attach, scanLayers=checkFeatureSelection)
+    finally:
+        if args.layer_cache:
+            saveLayerCache(layerCachePath)
+        if bufferCache:
+            arcpy.AddMessage(f"Buffer cache, whole batch: {bufferCache.hits:,} hits, {bufferCache.misses:,} misses")
+            bufferCache.close()
 
-        asbuiltSourceRaw = arcpy.GetParameterAsText(0)
-        asbuiltDateRaw = arcpy.GetParameterAsText(1)
-        asbuiltWUDNUMinput = arcpy.GetParameterAsText(2)
-        asbuiltWUDNUM = None if asbuiltWUDNUMinput is '' else asbuiltWUDNUMinput
-        buffersize = arcpy.GetParameter(3)  # + " Feet"
-        addAttach = arcpy.GetParameter(4)
+elif __name__ == '__main__':
 
-        asbuiltDateinput = asbuiltDateRaw.split(' ')[0]
-        asbuiltDate = None if asbuiltDateinput is '' else asbuiltDateinput
+    setUpArcpy()
+    bufferCache = None
+    try:
 
-        hyperlink = r"{}".format(asbuiltSourceRaw.replace(asbuiltSourceRaw.split('originals')[0], '..\\'))
-        arcpy.AddMessage(hyperlink)
-        pbcwudfile = os.path.basename(hyperlink)
+        addAttach = arcpy.GetParameter(4)
+        persistLayerCache = getOptionalParameter(6, False)
+        reportPath = getOptionalParameter(8, '')
+        bufferCachePath = getOptionalParameter(14, '')
+        if bufferCachePath:
+            bufferCache = AsBuilt_Cache.BufferCache(str(bufferCachePath))
 
         # List layers in currently opened map in project
         aprx = arcpy.mp.ArcGISProject('current')
         currentMap = aprx.activeMap
         lyrList = currentMap.listLayers()
 
-        abPoly = ()
-        for lyr in lyrList:
-            if lyr.isFeatureLayer:
+        abPoly, lyrdescPath, lyrworkspace = findAsBuiltPolygons(lyrList)
+
+        run = AsBuilt_Stages.AsBuiltRun(storage, arcpy, metrics,
+                                        buffersize=arcpy.GetParameter(3),  # + " Feet"
+                                        scratchWorkspace=aprx.defaultGeodatabase, template=lyrdescPath,
+                                        inMemoryDissolve=getOptionalParameter(5, False),
+                                        workers=int(getOptionalParameter(7, 1)),
+                                        incrementalMode=getOptionalParameter(9, False),
+                                        bufferStyle={'quad_segs': int(getOptionalParameter(10, 16)),
+                                                     'cap_style': getOptionalParameter(11, 'round').lower(),
+                                                     'join_style': getOptionalParameter(12, 'round').lower()},
+                                        simplifyFactor=float(getOptionalParameter(13, 0)),
+                                        bufferCache=bufferCache,
+                                        deleteMerged=getOptionalParameter(15, False))
+        run.setInputs(arcpy.GetParameterAsText(0), arcpy.GetParameterAsText(1), arcpy.GetParameterAsText(2))
+
+        metrics.reset()
+        with metrics.stage('checkFeatureSelection'):
+            if persistLayerCache:
+                layerCachePath = os.path.join(aprx.homeFolder, 'AsBuilt_layerCache.json')
+                loadLayerCache(layerCachePath)
                 try:
-                    lyrdesc = arcpy.Describe(lyr)
-                    if lyrdesc.Name == 'wGISRef.WUD.Asbuilt_Polygons':
-                        lyrdescPath = lyrdesc.catalogPath
-                        lyrworkspace = lyrdescPath.split('.sde')[0] + '.sde'
-                        lyrdescWS = arcpy.Describe(lyrworkspace)
-                        lyrcp = lyrdescWS.connectionProperties
-                        # arcpy.AddMessage(lyrdescPath)
-                        if (lyrcp.server).lower() == 'gisagl' and (lyrcp.database).lower() == 'wgisref':  # if (lyrcp.version).lower() != 'sde.default'
-                            abPoly = lyr.longName
-                            break
-                except (OSError, AttributeError):
-                    continue
-
-        if abPoly:
-            # arcpy.AddMessage("Found As-Built Polygon layer")
-            print("Found As-Built Polygon layer")
-
-        else:
-            raise ValueError("An Asbuilt Polygons layer from the GISagl_wGISRef database is not in the current map.  "
-                             "If it is in the map, make sure it is NOT the Default version.  "
-                             "Also, to avoid another versioning error, the layers you want to modify must be versioned.")
-
-        selLayers = checkFeatureSelection()
+                    selLayers = checkFeatureSelection()
+                finally:
+                    saveLayerCache(layerCachePath)
+            else:
+                selLayers = checkFeatureSelection()
 
         do_stuff()
 
@@ -438,4 +374,6 @@ if __name__ == '__main__':
         arcpy.AddError(f"An error occurred: {str(e)}")
 
     finally:
+        if bufferCache:
+            bufferCache.close()
         print('finished')
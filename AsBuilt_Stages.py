@@ -0,0 +1,507 @@
+"""
+The stages of the AsBuilt Polygon tool: updateSelected, createBuffers, addNewPolygons and addAttachment.  Nothing in
+here imports arcpy.  Every read and write goes through run.storage (see AsBuilt_Storage) and every message through
+run.messages, so the same functions run in ArcGIS Pro against the enterprise geodatabase and in the benchmarks
+against a GeoPackage.
+"""
+import datetime
+import hashlib
+import mmap
+import ntpath
+import os
+import time
+# AsBuilt_Engine (shapely, numpy) is imported by the stages that buffer, so a run that stops at the layer scan
+# doesn't pay for loading it
+import AsBuilt_Metrics
+import AsBuilt_Storage
+
+
+class PrintMessages:
+    # Message sink for runs outside ArcGIS Pro.  In the tool the arcpy module itself is the sink
+
+    @staticmethod
+    def AddMessage(message):
+        print(message)
+
+    @staticmethod
+    def AddWarning(message):
+        print(f"WARNING: {message}")
+
+
+class AsBuiltRun:
+    # The inputs of one as-built and the options every stage reads
+
+    def __init__(self, storage, messages=PrintMessages, metrics=None, buffersize=10, scratchWorkspace=None,
+                 template=None, inMemoryDissolve=False, workers=1, incrementalMode=False, bufferStyle=None,
+                 simplifyFactor=0, bufferCache=None, deleteMerged=False):
+        self.storage = storage
+        self.messages = messages
+        self.metrics = metrics if metrics is not None else AsBuilt_Metrics.RunMetrics(storage.counters)
+        self.buffersize = buffersize
+        # Where the scratch asBuiltBuffers feature class goes, and the dataset its schema comes from
+        self.scratchWorkspace = scratchWorkspace
+        self.template = template
+        self.inMemoryDissolve = inMemoryDissolve
+        self.workers = workers
+        self.incrementalMode = incrementalMode
+        # Incremental runs delete the existing polygons of the as-built that were unioned into another one, with
+        # their attachments.  Off, they are only reported
+        self.deleteMerged = deleteMerged
+        self.bufferStyle = bufferStyle
+        self.simplifyFactor = simplifyFactor
+        # Buffered geometry of earlier runs, see AsBuilt_Cache.  None when the run has no buffer cache
+        self.bufferCache = bufferCache
+
+    # Set the as-built inputs from the text the user entered
+    def setInputs(self, sourceRaw, dateRaw, wudnumInput):
+        self.asbuiltSourceRaw = sourceRaw
+        self.asbuiltWUDNUM = None if wudnumInput == '' else wudnumInput
+
+        asbuiltDateinput = dateRaw.split(' ')[0]
+        self.asbuiltDate = None if asbuiltDateinput == '' else asbuiltDateinput
+
+        self.hyperlink = r"{}".format(sourceRaw.replace(sourceRaw.split('originals')[0], '..\\'))
+        self.messages.AddMessage(self.hyperlink)
+        # The hyperlink is a Windows path wherever the stages run
+        self.pbcwudfile = ntpath.basename(self.hyperlink)
+
+
+# return the name of a map layer, or the dataset itself, for messages
+def datasetName(dataset):
+    return getattr(dataset, 'longName', dataset)
+
+
+# return True if the ASBUILTDATE value read from a layer is the date the user entered
+def sameAsBuiltDate(value, dateText):
+    if value is None or dateText is None:
+        return value is None and dateText is None
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        for dateFormat in ('%m/%d/%Y', '%Y-%m-%d'):
+            try:
+                return value == datetime.datetime.strptime(dateText, dateFormat).date()
+            except ValueError:
+                continue
+        return False
+    return value == dateText
+
+
+def updateSelected(run, selLayers):
+    storage = run.storage
+
+    print("Populating SOURCE and ASBUILTDATE fields for selected features.")
+    run.messages.AddMessage("Populating SOURCE and ASBUILTDATE fields for selected features.")
+    # Fill out SOURCE and ASBUILTDATE fields for the selected features
+    # (this step is not for the as-built polygons, thats later)
+    # The selected rows are read first.  Only rows that differ are written, in one edit session per workspace,
+    # and a re-run where nothing changed never starts an edit session.
+    source = r"{}".format(run.hyperlink)
+    changedLayers = {}
+    rowsScanned = 0
+    for eachlayer in selLayers:
+        changedOids = []
+        with storage.searchCursor(eachlayer, ['OID@', 'SOURCE', 'ASBUILTDATE']) as cursor:
+            for row in cursor:
+                rowsScanned += 1
+                if row[1] != source or not sameAsBuiltDate(row[2], run.asbuiltDate):
+                    changedOids.append(row[0])
+        if changedOids:
+            changedLayers.setdefault(storage.workspace(eachlayer), []).append((eachlayer, changedOids))
+
+    rowsWritten = 0
+    for workspace, layers in changedLayers.items():
+        with storage.editor(workspace, versioned=storage.describe(layers[0][0]).isVersioned):
+            for eachlayer, changedOids in layers:
+                for sqlquery in AsBuilt_Storage.oidWhereClauses(changedOids):
+                    with storage.updateCursor(eachlayer, ['SOURCE', 'ASBUILTDATE'], sqlquery) as cursor:
+                        for row in cursor:
+                            row[0] = source
+                            row[1] = run.asbuiltDate
+                            cursor.updateRow(row)
+                            rowsWritten += 1
+
+    run.metrics.count('rows', rowsScanned)
+    run.metrics.count('rowsWritten', rowsWritten)
+    run.messages.AddMessage(f"{rowsScanned:,} selected rows scanned, {rowsWritten:,} written "
+                            f"in {len(changedLayers)} workspace edit session(s).")
+
+
+# return dissolvedBuffer: the dissolved feature class, or a list of dissolved rows when they are kept in memory
+def createBuffers(run, selLayers):
+    import AsBuilt_Engine
+    storage = run.storage
+    metrics = run.metrics
+
+    workspace = run.scratchWorkspace
+
+    asbuiltNo = os.path.splitext(os.path.basename(run.pbcwudfile))[0][0:7]
+    p56 = run.hyperlink.replace("/", "\\").split("\\")[2]
+    # if the 5th position is an underscore, it's an assumed asbuilt number
+    if run.pbcwudfile[4] == '_':
+        # get first 4 characters of filename
+        asbuiltNo = os.path.splitext(os.path.basename(run.pbcwudfile))[0][0:4]
+
+
+    fields = AsBuilt_Engine.DISSOLVE_FIELDS + ['SHAPE@WKB']
+
+    print("Creating Buffers for the selected features:")
+    fieldsWaterType = {"WATER": "Potable", "SEWER": "Sewage", "RECLAIMED": "Reclaimed", "RAW": "Raw",
+                       "OTHER": "Treated"}
+    # Without the cache, an in-memory dissolve with workers buffers and dissolves in the same pool: the rows keep
+    # their input WKB and the buffers never come back to this process one by one
+    bufferInDissolve = run.inMemoryDissolve and not run.bufferCache and run.workers > 1
+    bufferRows = []
+    emptyBuffers = 0
+    for each in selLayers:
+        desc = storage.describe(each)
+        try:
+            FID = desc.FIDSet
+        except():
+            continue
+        if FID and desc.shapeType in ('Polyline', 'Point'):
+            print("Making buffer for: {}".format(datasetName(each)))  # desc.name
+            run.messages.AddMessage("Making buffer for: {}".format(datasetName(each)))  # desc.name
+            if desc.shapeType == 'Point' and (run.bufferStyle or {}).get('cap_style') == 'flat':
+                run.messages.AddMessage("Flat end caps only apply to lines, the points are buffered with round caps.")
+
+            # Read every selected feature of the layer first, then buffer them all in one call.
+            # Geometry crosses over to shapely as WKB, so multipart lines keep their parts.
+            oids = []
+            waterTypes = []
+            wkbGeometries = []
+            with metrics.stage('read'):
+                for sqlquery in AsBuilt_Storage.oidWhereClauses(FID.split(';'), honorSelection=True):
+                    with storage.searchCursor(each, ["OID@", "WATERTYPE", "SHAPE@WKB"], where_clause=sqlquery,
+                                              spatial_reference=storage.spatialReference) as search_cursor:
+                        for row in search_cursor:
+                            oids.append(row[0])
+                            waterTypes.append(row[1])
+                            wkbGeometries.append(bytes(row[2]))
+                metrics.count('rows', len(wkbGeometries))
+                metrics.count('vertices', AsBuilt_Engine.countWkbVertices(wkbGeometries))
+
+            if bufferInDissolve:
+                shapeField, buffers = 'SHAPE@WKB', wkbGeometries
+            else:
+                with metrics.stage('buffer'):
+                    if run.bufferCache:
+                        buffers = bufferWithCache(run, desc.catalogPath, oids, wkbGeometries)
+                    else:
+                        buffers = AsBuilt_Engine.bufferWkb(wkbGeometries, run.buffersize, run.workers,
+                                                           run.bufferStyle)
+                    metrics.count('rows', len(buffers))
+                    metrics.count('vertices', AsBuilt_Engine.countVertices(buffers))
+                shapeField = 'SHAPE@'
+
+            for waterType, bufferPoly in zip(waterTypes, buffers):
+                if shapeField == 'SHAPE@' and bufferPoly.is_empty:
+                    emptyBuffers += 1
+                    continue
+                featureBuffer = {'PBCWUDFILE': run.pbcwudfile, 'HYPERLINK': run.hyperlink,
+                                 'P56FOLDER': p56, 'ASBUILTNO': asbuiltNo,
+                                 'ASBUILTDATE': run.asbuiltDate, 'WUDPROJECTNUM': run.asbuiltWUDNUM,
+                                 'WATER': 'No', 'SEWER': 'No',
+                                 'RECLAIMED': 'No', 'RAW': 'No', 'OTHER': 'No',
+                                 'LifeCycleStatusRemoved': 'No', shapeField: bufferPoly}
+                for output_field, input_value in fieldsWaterType.items():
+                    if waterType == input_value:
+                        featureBuffer[output_field] = 'Yes'
+                bufferRows.append(featureBuffer)
+
+    if emptyBuffers:
+        run.messages.AddWarning(f"{emptyBuffers} selected feature(s) gave an empty buffer and were left out.")
+
+    print("Populating other required fields for buffer.")
+    # If their hyperlink is the same, the buffers share their 'watertype' 'Yes' values
+    AsBuilt_Engine.rollupWaterTypes(bufferRows)
+
+    if run.inMemoryDissolve:
+        # Union the buffers in memory and hand the rows straight to addNewPolygons, no scratch feature classes
+        print("Dissolving Buffers in memory")
+        with metrics.stage('dissolve'):
+            if bufferInDissolve:
+                dissolvedRows = AsBuilt_Engine.bufferDissolveWkb(bufferRows, run.buffersize, run.workers,
+                                                                 run.bufferStyle)
+            else:
+                dissolvedRows = AsBuilt_Engine.dissolveBuffers(bufferRows)
+            # Buffered in the pool, empty buffers only show up as an empty dissolved polygon
+            emptyRows = sum(1 for row in dissolvedRows if row['SHAPE@'].is_empty)
+            dissolvedRows = [row for row in dissolvedRows if not row['SHAPE@'].is_empty]
+            metrics.count('rows', len(dissolvedRows))
+            metrics.count('vertices', AsBuilt_Engine.countVertices([row['SHAPE@'] for row in dissolvedRows]))
+        if emptyRows:
+            run.messages.AddWarning(f"{emptyRows} dissolved polygon(s) came out empty and were left out.")
+        return simplifyDissolved(run, dissolvedRows)
+
+    # Create asBuiltBuffers:
+    print("Checking if asBuiltBuffer layer exists.  If it does, clear the table.")
+    asBuiltBuffers = storage.createFeatureClass(workspace, "asBuiltBuffers", run.template)
+
+    with metrics.stage('insert'), storage.editor(workspace, versioned=False):
+        with storage.insertCursor(asBuiltBuffers, fields) as insertCursor:
+            bufferWkbs = AsBuilt_Engine.toWkb([featureBuffer['SHAPE@'] for featureBuffer in bufferRows])
+            for featureBuffer, bufferWkb in zip(bufferRows, bufferWkbs):
+                insertCursor.insertRow([featureBuffer[field] for field in fields[:-1]] + [bufferWkb])
+        metrics.count('rows', len(bufferRows))
+
+    print("Dissolving Buffers")
+    dissolvedBufferPath = storage.datasetPath(workspace, "asBuiltBuffer_dissolved")
+
+    with metrics.stage('dissolve'):
+        dissolvedBuffer = storage.dissolve(asBuiltBuffers, dissolvedBufferPath, AsBuilt_Engine.DISSOLVE_FIELDS)
+
+    if run.simplifyFactor > 0:
+        return simplifyDissolved(run, readPolygonRows(run, dissolvedBuffer, AsBuilt_Engine.DISSOLVE_FIELDS))
+    return dissolvedBuffer
+
+
+# return list of buffered shapely geometries, in the same order as wkbGeometries
+def bufferWithCache(run, catalogPath, oids, wkbGeometries):
+    import AsBuilt_Engine
+    bufferCache = run.bufferCache
+
+    # Only the features that are new, were reshaped, or were last buffered with other settings are buffered,
+    # the rest come out of the cache
+    style = run.bufferStyle or AsBuilt_Engine.BUFFER_STYLE
+    keys = [bufferCache.makeKey(catalogPath, oid, wkb, run.buffersize, style) for oid, wkb in zip(oids, wkbGeometries)]
+    cached = bufferCache.getMany(keys)
+    missing = [index for index, key in enumerate(keys) if key not in cached]
+    run.metrics.count('cacheHits', len(keys) - len(missing))
+    run.metrics.count('cacheMisses', len(missing))
+
+    if missing:
+        newBuffers = AsBuilt_Engine.bufferWkb([wkbGeometries[index] for index in missing], run.buffersize,
+                                              run.workers, run.bufferStyle)
+        newWkbs = AsBuilt_Engine.toWkb(newBuffers)
+        bufferCache.putMany([(keys[index], wkb) for index, wkb in zip(missing, newWkbs)])
+        cached.update((keys[index], wkb) for index, wkb in zip(missing, newWkbs))
+
+    return list(AsBuilt_Engine.fromWkb([cached[key] for key in keys]))
+
+
+# return dissolvedRows simplified with a tolerance of simplifyFactor * buffersize
+def simplifyDissolved(run, dissolvedRows):
+    import AsBuilt_Engine
+    if run.simplifyFactor <= 0:
+        return dissolvedRows
+
+    with run.metrics.stage('simplify'):
+        tolerance = float(run.simplifyFactor) * float(run.buffersize)
+        verticesBefore = AsBuilt_Engine.countVertices([row['SHAPE@'] for row in dissolvedRows])
+        AsBuilt_Engine.simplifyRows(dissolvedRows, tolerance)
+        verticesAfter = AsBuilt_Engine.countVertices([row['SHAPE@'] for row in dissolvedRows])
+        run.metrics.count('rows', len(dissolvedRows))
+        run.metrics.count('vertices', verticesAfter)
+    run.messages.AddMessage(f"Simplified polygons (tolerance {tolerance:g}): {verticesBefore:,} vertices before, "
+                            f"{verticesAfter:,} after.")
+    return dissolvedRows
+
+
+# return list of dictionaries for the rows of a dataset, with SHAPE@ as a shapely geometry
+def readPolygonRows(run, dataset, fields, where_clause=None):
+    import AsBuilt_Engine
+    rows = []
+    with run.storage.searchCursor(dataset, fields + ['SHAPE@WKB'], where_clause=where_clause,
+                                  spatial_reference=run.storage.spatialReference) as cursor:
+        for row in cursor:
+            rows.append(dict(zip(fields + ['SHAPE@WKB'], row)))
+    for row, geometry in zip(rows, AsBuilt_Engine.fromWkb([bytes(row.pop('SHAPE@WKB')) for row in rows])):
+        row['SHAPE@'] = geometry
+    return rows
+
+
+# return list of (OID, GlobalID) of the inserted polygons, and of the updated ones in incremental mode
+def addNewPolygons(run, dissolvedBuffer, abPoly):
+    import AsBuilt_Engine
+    storage = run.storage
+    metrics = run.metrics
+
+    abDesc = storage.describe(abPoly)
+    run.messages.AddMessage("Adding new polygons.")
+    workspace = storage.workspace(abPoly)
+
+    updatedRows = []
+    deletedOids = []
+    if run.incrementalMode:
+        # Merge into the polygons this as-built already has instead of piling up overlapping duplicates
+        if not isinstance(dissolvedBuffer, list):
+            dissolvedBuffer = readPolygonRows(run, dissolvedBuffer, AsBuilt_Engine.DISSOLVE_FIELDS)
+        sqlquery = "HYPERLINK = '{}'".format(run.hyperlink.replace("'", "''"))
+        existingRows = readPolygonRows(run, abDesc.catalogPath, ['OID@'] + AsBuilt_Engine.DISSOLVE_FIELDS, sqlquery)
+        updatedRows, dissolvedBuffer, overlappingOids = AsBuilt_Engine.mergeIntoExisting(dissolvedBuffer, existingRows,
+                                                                                         run.deleteMerged)
+        oidList = ", ".join(str(oid) for oid in overlappingOids)
+        if overlappingOids and run.deleteMerged:
+            deletedOids = overlappingOids
+            run.messages.AddWarning(f"Deleting as-built polygon(s) {oidList}, merged into the polygon(s) "
+                                    f"{', '.join(str(row['OID@']) for row in updatedRows)} with their attachments.")
+        elif overlappingOids:
+            run.messages.AddWarning(f"As-built polygon(s) {oidList} of this as-built overlap the updated polygon(s) "
+                                    f"and were left as they are.  Run with delete merged polygons to merge them.")
+
+    newOids = []
+    with storage.editor(workspace, versioned=abDesc.isVersioned):
+        if updatedRows:
+            updateFields = AsBuilt_Engine.DISSOLVE_FIELDS + ['SHAPE@']
+            rowsByOid = {row['OID@']: row for row in updatedRows}
+            for sqlquery in AsBuilt_Storage.oidWhereClauses(list(rowsByOid)):
+                with storage.updateCursor(abDesc.catalogPath, ['OID@'] + updateFields, sqlquery) as cursor:
+                    for row in cursor:
+                        mergedRow = rowsByOid[row[0]]
+                        shape = storage.shapeFromWkb(mergedRow['SHAPE@'].wkb)
+                        cursor.updateRow([row[0]] + [mergedRow[field] for field in updateFields[:-1]] + [shape])
+                        metrics.count('rowsUpdated')
+
+        # Polygons of the as-built that were unioned into a lower OID, only with run.deleteMerged
+        for sqlquery in AsBuilt_Storage.oidWhereClauses(deletedOids):
+            with storage.updateCursor(abDesc.catalogPath, ['OID@'], sqlquery) as cursor:
+                for row in cursor:
+                    cursor.deleteRow()
+                    metrics.count('rowsDeleted')
+
+        if isinstance(dissolvedBuffer, list):
+            # In-memory dissolve: rows are dictionaries with a shapely geometry
+            lstFields = AsBuilt_Engine.DISSOLVE_FIELDS + ['SHAPE@']
+            dissolvedWkbs = AsBuilt_Engine.toWkb([row['SHAPE@'] for row in dissolvedBuffer])
+            with storage.insertCursor(abPoly, lstFields) as targetCursor:
+                for row, dissolvedWkb in zip(dissolvedBuffer, dissolvedWkbs):
+                    shape = storage.shapeFromWkb(dissolvedWkb)
+                    newOids.append(targetCursor.insertRow([row[field] for field in lstFields[:-1]] + [shape]))
+                    metrics.count('rows')
+        else:
+            lstFields = [field for field in storage.listFields(dissolvedBuffer) if field in AsBuilt_Engine.DISSOLVE_FIELDS]
+            lstFields.append('SHAPE@')
+            targetCursor = storage.insertCursor(abPoly, lstFields)
+
+            with storage.searchCursor(dissolvedBuffer, lstFields) as cursor:
+                for row in cursor:
+                    newOids.append(targetCursor.insertRow(row))
+                    metrics.count('rows')
+            del targetCursor
+
+    del dissolvedBuffer
+    if run.incrementalMode:
+        run.messages.AddMessage(f"{len(updatedRows)} existing polygon(s) updated, {len(deletedOids)} merged into "
+                                f"them and deleted, {len(newOids)} inserted.")
+
+    # The insert cursor hands back the OIDs, their GlobalIDs come from one keyed query
+    newPolygons = []
+    for sqlquery in AsBuilt_Storage.oidWhereClauses(newOids + [row['OID@'] for row in updatedRows]):
+        with storage.searchCursor(abDesc.catalogPath, ["OID@", "GLOBALID"], sqlquery) as cursor:
+            newPolygons.extend(tuple(row) for row in cursor)
+    return newPolygons
+
+
+# return the sha256 hex digest of a file, read in chunks so the whole file is never in memory
+def fileHash(path, chunkSize=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunkSize), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# return the sha256 hex digest of an attachment read from a cursor, hashed in chunks without copying the BLOB
+def blobHash(blob, chunkSize=1024 * 1024):
+    digest = hashlib.sha256()
+    with memoryview(blob) as view:
+        for start in range(0, len(view), chunkSize):
+            digest.update(view[start:start + chunkSize])
+    return digest.hexdigest()
+
+
+# return True if the attachment table already holds an identical file for the polygon
+def attachmentExists(run, attachTable, relGlobalId, fileName, fileSize, fileDigest):
+    # Only attachments with the same name and size are read back, one row at a time, so a re-run holds at most one
+    # stored scan in memory and usually just the one it is about to skip
+    sqlquery = "REL_GLOBALID = '{}' AND ATT_NAME = '{}' AND DATA_SIZE = {}".format(relGlobalId,
+                                                                                 fileName.replace("'", "''"), fileSize)
+    with run.storage.searchCursor(attachTable, ["DATA"], sqlquery) as cursor:
+        for row in cursor:
+            matched = blobHash(row[0]) == fileDigest
+            del row
+            if matched:
+                return True
+    return False
+
+
+def addAttachment(run, abPoly, newPolygons):
+    storage = run.storage
+
+    # The new polygons come from addNewPolygons, so no search of the whole as-built table is needed
+    # and another editor's polygon can't be picked up
+    print(newPolygons)
+
+    abDesc = storage.describe(abPoly)
+    attachTable = storage.attachmentTable(abPoly)
+    fileSize = os.path.getsize(run.asbuiltSourceRaw)
+    fileDigest = fileHash(run.asbuiltSourceRaw)
+    attachTo = []
+    for newAbPolyID in newPolygons:
+        run.messages.AddMessage(f"{newAbPolyID[0]} {newAbPolyID[1]}")
+        if attachmentExists(run, attachTable, newAbPolyID[1], run.pbcwudfile, fileSize, fileDigest):
+            run.messages.AddMessage(f"{run.pbcwudfile} is already attached to polygon {newAbPolyID[0]}, "
+                                    f"skipping the upload.")
+        else:
+            attachTo.append(newAbPolyID)
+    if not attachTo:
+        return
+
+    run.messages.AddMessage("Adding attachments.")
+    uploadStart = time.perf_counter()
+    workspace = storage.workspace(abPoly)
+    with storage.editor(workspace, versioned=abDesc.isVersioned):
+        with storage.insertCursor(attachTable,
+                                  ["DATA", "ATT_NAME", "ATTACHMENTID", "REL_GLOBALID"]) as cursor:
+            if fileSize == 0:
+                for newAbPolyID in attachTo:
+                    cursor.insertRow([b'', run.pbcwudfile, newAbPolyID[0], newAbPolyID[1]])
+            else:
+                # Memory-map the file so a large scan isn't copied into a bytes object before the insert
+                with open(run.asbuiltSourceRaw, 'rb') as file, \
+                        mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as fileMap, \
+                        memoryview(fileMap) as binary_data:
+                    for newAbPolyID in attachTo:
+                        cursor.insertRow([binary_data, run.pbcwudfile, newAbPolyID[0], newAbPolyID[1]])
+
+    run.metrics.count('rows', len(attachTo))
+    run.metrics.count('bytes', fileSize * len(attachTo))
+    run.messages.AddMessage(f"Uploaded {fileSize * len(attachTo):,} bytes to {len(attachTo)} polygon(s) "
+                            f"in {time.perf_counter() - uploadStart:.2f} s.")
+
+
+# Run the stages of do_stuff for the selected layers
+def runStages(run, selLayers, abPoly, addAttach, progress=None, saveProgress=None):
+    # progress lists the stages that wrote and committed their edits, and the polygons addNewPolygons made.  Stages
+    # already in it are skipped, and saveProgress gets it after each one, so a batch entry that failed half way
+    # resumes where it stopped instead of inserting its polygons again.
+    metrics = run.metrics
+    if progress is None:
+        progress = {'completed': [], 'newPolygons': []}
+    completed = progress['completed']
+
+    if 'updateSelected' not in completed:
+        with metrics.stage('updateSelected'):
+            updateSelected(run, selLayers)
+        completed.append('updateSelected')
+        if saveProgress:
+            saveProgress(progress)
+    if 'addNewPolygons' not in completed:
+        with metrics.stage('createBuffers'):
+            dissolvedBuffer = createBuffers(run, selLayers)
+        with metrics.stage('addNewPolygons'):
+            progress['newPolygons'] = addNewPolygons(run, dissolvedBuffer, abPoly)
+        completed.append('addNewPolygons')
+        if saveProgress:
+            saveProgress(progress)
+    if addAttach == 1 and 'addAttachment' not in completed:
+        with metrics.stage('addAttachment'):
+            addAttachment(run, abPoly, progress['newPolygons'])
+        completed.append('addAttachment')
+        if saveProgress:
+            saveProgress(progress)
+    # Refresh the layer
+    with metrics.stage('refreshLayer'):
+        run.storage.refreshLayer(abPoly)
+    return progress
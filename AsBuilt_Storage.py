@@ -0,0 +1,388 @@
+"""
+Data access for the AsBuilt Polygon tool.  The tool's stages read and write through a storage object instead of
+calling arcpy directly, so the same steps can be profiled and regression tested against a local GeoPackage outside
+of ArcGIS Pro.
+
+ArcpyStorage is what the tool uses in ArcGIS Pro.  GeoPackageStorage is a pure-Python stand-in over sqlite3 that
+follows the same cursor conventions (arcpy field tokens, SQL where clauses, edit sessions as transactions).
+"""
+import os
+import sqlite3
+import struct
+import uuid
+from types import SimpleNamespace
+
+# Selection to query translation.  Contiguous OIDs become ranges, the rest go in IN lists of at most IN_LIST_MAX
+# (Oracle rejects longer lists, other databases plan them badly).  Above SELECTION_CURSOR_MIN OIDs a cursor on the
+# layer is opened without a where clause and the layer's own selection does the filtering.
+IN_LIST_MAX = 1000
+RANGE_MIN = 3
+RANGES_PER_CLAUSE = 100
+SELECTION_CURSOR_MIN = 50000
+
+
+# return (ranges, singles): runs of at least RANGE_MIN consecutive OIDs as (first, last), and the OIDs left over
+def compressOids(oids):
+    ranges = []
+    singles = []
+    oids = sorted(set(int(oid) for oid in oids))
+    start = 0
+    for index in range(1, len(oids) + 1):
+        if index == len(oids) or oids[index] != oids[index - 1] + 1:
+            run = oids[start:index]
+            if len(run) >= RANGE_MIN:
+                ranges.append((run[0], run[-1]))
+            else:
+                singles.extend(run)
+            start = index
+    return ranges, singles
+
+
+# return list of where clauses that together select oids.  [None] means use the layer's selection instead.
+def oidWhereClauses(oids, oidField='OBJECTID', honorSelection=False):
+    if not oids:
+        return []
+    if honorSelection and len(oids) >= SELECTION_CURSOR_MIN:
+        return [None]
+
+    ranges, singles = compressOids(oids)
+    clauses = []
+    for start in range(0, len(ranges), RANGES_PER_CLAUSE):
+        clauses.append(" OR ".join(f"({oidField} >= {first} AND {oidField} <= {last})"
+                                   for first, last in ranges[start:start + RANGES_PER_CLAUSE]))
+    for start in range(0, len(singles), IN_LIST_MAX):
+        clauses.append("{0} IN ({1})".format(oidField, ",".join(str(oid) for oid in singles[start:start + IN_LIST_MAX])))
+    return clauses
+
+
+class ArcpyStorage:
+    # Enterprise geodatabase through arcpy
+
+    def __init__(self):
+        import arcpy
+        self.arcpy = arcpy
+        self.spatialReference = arcpy.SpatialReference(2236)
+        self.counters = {'cursorsOpened': 0, 'editSessions': 0}
+
+    def describe(self, dataset):
+        return self.arcpy.Describe(dataset)
+
+    def listFields(self, dataset):
+        return [field.name for field in self.arcpy.ListFields(dataset)]
+
+    # return the workspace an edit session on dataset has to be opened on
+    def workspace(self, dataset):
+        workspace = os.path.dirname(self.arcpy.Describe(dataset).catalogPath)
+        desc = self.arcpy.Describe(workspace)
+        if hasattr(desc, "datasetType") and desc.datasetType == 'FeatureDataset':
+            workspace = os.path.dirname(workspace)
+        return workspace
+
+    def searchCursor(self, dataset, fields, where_clause=None, spatial_reference=None, sql_clause=(None, None)):
+        self.counters['cursorsOpened'] += 1
+        return self.arcpy.da.SearchCursor(dataset, fields, where_clause=where_clause,
+                                          spatial_reference=spatial_reference, sql_clause=sql_clause)
+
+    def insertCursor(self, dataset, fields):
+        self.counters['cursorsOpened'] += 1
+        return self.arcpy.da.InsertCursor(dataset, fields)
+
+    def updateCursor(self, dataset, fields, where_clause=None):
+        self.counters['cursorsOpened'] += 1
+        return self.arcpy.da.UpdateCursor(dataset, fields, where_clause=where_clause)
+
+    def editor(self, workspace, versioned=False):
+        self.counters['editSessions'] += 1
+        return self.arcpy.da.Editor(workspace, multiuser_mode=versioned)
+
+    def createFeatureClass(self, workspace, name, template):
+        return self.arcpy.CreateFeatureclass_management(workspace, name, 'POLYGON', template,
+                                                        'SAME_AS_TEMPLATE', 'SAME_AS_TEMPLATE', '2236')
+
+    def dissolve(self, dataset, output, fields):
+        return self.arcpy.management.Dissolve(dataset, output, ";".join(fields),
+                                              None, "MULTI_PART", "DISSOLVE_LINES", '')
+
+    # return the path of the dataset name in workspace
+    def datasetPath(self, workspace, name):
+        return workspace + "\\" + name
+
+    # The attachment table sits in the workspace of the dataset, next to its feature dataset if it has one
+    def attachmentTable(self, dataset):
+        return self.datasetPath(self.workspace(dataset), f"{self.arcpy.Describe(dataset).Name}__ATTACH")
+
+    # Select features of a map layer by OID list or where clause
+    def select(self, layer, selection):
+        if isinstance(selection, list):
+            layer.setSelectionSet(selection, 'NEW')
+        else:
+            self.arcpy.management.SelectLayerByAttribute(layer, 'NEW_SELECTION', selection)
+
+    def clearSelection(self, layer):
+        if layer.getSelectionSet():
+            self.arcpy.management.SelectLayerByAttribute(layer, 'CLEAR_SELECTION')
+
+    # Redraw a map layer after its features were edited
+    def refreshLayer(self, layer):
+        self.arcpy.env.addOutputsToMap = True
+        self.arcpy.management.ApplySymbologyFromLayer(layer, layer, update_symbology="MAINTAIN")
+
+    # return a geometry the insert cursors accept for SHAPE@
+    def shapeFromWkb(self, wkb):
+        return self.arcpy.FromWKB(bytearray(wkb), self.spatialReference)
+
+
+class GeoPackageStorage:
+    # Local GeoPackage (SQLite) stand-in.  Datasets are table names, every table has an OBJECTID key and a SHAPE column.
+
+    GEOMETRY_TYPES = {'POINT': 'Point', 'MULTIPOINT': 'Multipoint', 'LINESTRING': 'Polyline',
+                      'MULTILINESTRING': 'Polyline', 'POLYGON': 'Polygon', 'MULTIPOLYGON': 'Polygon'}
+
+    def __init__(self, path, srsId=2236):
+        self.path = path
+        self.srsId = srsId
+        self.spatialReference = None
+        self.selections = {}
+        self.counters = {'cursorsOpened': 0, 'editSessions': 0}
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute("PRAGMA application_id = 1196444487")  # 'GPKG'
+        self.connection.execute("PRAGMA user_version = 10300")
+        self.createMetadataTables()
+
+    def createMetadataTables(self):
+        self.connection.executescript(f"""
+            CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+                srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+                organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+            CREATE TABLE IF NOT EXISTS gpkg_contents (
+                table_name TEXT PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '',
+                last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+                min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER);
+            CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (
+                table_name TEXT PRIMARY KEY, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+                srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL);
+            INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES
+                ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', NULL),
+                ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', NULL),
+                ('EPSG:{self.srsId}', {self.srsId}, 'EPSG', {self.srsId}, 'undefined', NULL);
+        """)
+
+    # Create a feature table.  fields is a list of (name, SQL type)
+    def createLayer(self, name, geometryType, fields):
+        self.connection.execute(f'DROP TABLE IF EXISTS "{name}"')
+        self.connection.execute(f"DELETE FROM gpkg_contents WHERE table_name = ?", (name,))
+        self.connection.execute(f"DELETE FROM gpkg_geometry_columns WHERE table_name = ?", (name,))
+        columns = ", ".join(f'"{field}" {fieldType}' for field, fieldType in fields)
+        self.connection.execute(f'CREATE TABLE "{name}" (OBJECTID INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                f'SHAPE BLOB{", " + columns if columns else ""})')
+        self.connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) "
+                                "VALUES (?, 'features', ?, ?)", (name, name, self.srsId))
+        self.connection.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'SHAPE', ?, ?, 0, 0)",
+                                (name, geometryType, self.srsId))
+        return name
+
+    # Stand-in for a map layer selection, by OIDs or where clause
+    def select(self, dataset, selection):
+        if isinstance(selection, str):
+            query = f'SELECT OBJECTID FROM "{dataset}"' + (f" WHERE {selection}" if selection else "")
+            selection = [row[0] for row in self.connection.execute(query)]
+        self.selections[dataset] = set(selection)
+
+    def clearSelection(self, dataset):
+        self.selections.pop(dataset, None)
+
+    def describe(self, dataset):
+        geometryType = self.connection.execute("SELECT geometry_type_name FROM gpkg_geometry_columns "
+                                                "WHERE table_name = ?", (dataset,)).fetchone()
+        return SimpleNamespace(name=dataset, Name=dataset, catalogPath=dataset, isVersioned=False,
+                               shapeType=self.GEOMETRY_TYPES.get(geometryType[0]) if geometryType else None,
+                               FIDSet=";".join(str(oid) for oid in sorted(self.selections.get(dataset, ()))))
+
+    def listFields(self, dataset):
+        return [row[1] for row in self.connection.execute(f'PRAGMA table_info("{dataset}")')]
+
+    def workspace(self, dataset):
+        return self.path
+
+    def searchCursor(self, dataset, fields, where_clause=None, spatial_reference=None, sql_clause=(None, None)):
+        self.counters['cursorsOpened'] += 1
+        return GeoPackageSearchCursor(self, dataset, fields, where_clause, sql_clause)
+
+    def insertCursor(self, dataset, fields):
+        self.counters['cursorsOpened'] += 1
+        return GeoPackageInsertCursor(self, dataset, fields)
+
+    def updateCursor(self, dataset, fields, where_clause=None):
+        self.counters['cursorsOpened'] += 1
+        return GeoPackageUpdateCursor(self, dataset, fields, where_clause)
+
+    def editor(self, workspace, versioned=False):
+        self.counters['editSessions'] += 1
+        return GeoPackageEditor(self.connection)
+
+    def createFeatureClass(self, workspace, name, template):
+        fields = [(row[1], row[2]) for row in self.connection.execute(f'PRAGMA table_info("{template}")')
+                  if row[1] not in ('OBJECTID', 'SHAPE')]
+        return self.createLayer(name, 'MULTIPOLYGON', fields)
+
+    def dissolve(self, dataset, output, fields):
+        import AsBuilt_Engine
+        bufferRows = []
+        with self.searchCursor(dataset, fields + ['SHAPE@']) as cursor:
+            for row in cursor:
+                bufferRows.append(dict(zip(fields + ['SHAPE@'], row)))
+        self.createFeatureClass(self.path, output, dataset)
+        dissolvedRows = AsBuilt_Engine.dissolveBuffers(bufferRows)
+        with self.insertCursor(output, fields + ['SHAPE@WKB']) as cursor:
+            for row in dissolvedRows:
+                cursor.insertRow([row[field] for field in fields] + [row['SHAPE@'].wkb])
+        return output
+
+    def datasetPath(self, workspace, name):
+        return name
+
+    def attachmentTable(self, dataset):
+        name = f"{dataset}__ATTACH"
+        self.connection.execute(f'CREATE TABLE IF NOT EXISTS "{name}" (OBJECTID INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                f'ATTACHMENTID INTEGER, REL_GLOBALID TEXT, CONTENT_TYPE TEXT, ATT_NAME TEXT, '
+                                f'DATA_SIZE INTEGER, DATA BLOB)')
+        return name
+
+    def refreshLayer(self, layer):
+        pass
+
+    def shapeFromWkb(self, wkb):
+        return bytes(wkb)
+
+    # return the GeoPackage geometry blob for WKB: 'GP' header, version 0, little endian flags, srs id
+    def toBlob(self, wkb):
+        return b'GP\x00\x01' + struct.pack('<i', self.srsId) + bytes(wkb)
+
+    @staticmethod
+    def fromBlob(blob):
+        if blob is None:
+            return None
+        envelopeSize = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}[(blob[3] >> 1) & 0x07]
+        return bytes(blob[8 + envelopeSize:])
+
+
+class GeoPackageEditor:
+    # Edit session stand-in: one transaction, rolled back if the block raises
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN")
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.connection.execute("ROLLBACK" if excType else "COMMIT")
+        return False
+
+
+class GeoPackageCursor:
+    # Translates arcpy field tokens into columns of the feature table
+
+    def __init__(self, storage, dataset, fields):
+        self.storage = storage
+        self.dataset = dataset
+        self.fields = list(fields)
+        self.columns = ['OBJECTID' if field == 'OID@' else 'SHAPE' if field.startswith('SHAPE@') else field
+                        for field in self.fields]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+    # return the SELECT for the cursor.  Like a cursor on an arcpy layer, a selection on the dataset is honored
+    def selectQuery(self, columns, where_clause):
+        query = "SELECT {} FROM \"{}\"".format(", ".join(f'"{column}"' for column in columns), self.dataset)
+        clauses = [f"({where_clause})"] if where_clause else []
+        if self.dataset in self.storage.selections:
+            clauses.append("OBJECTID IN ({})".format(",".join(str(oid) for oid in self.storage.selections[self.dataset])))
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        return query
+
+    def readValue(self, field, value):
+        if field == 'SHAPE@WKB':
+            return self.storage.fromBlob(value)
+        if field == 'SHAPE@':
+            import AsBuilt_Engine
+            wkb = self.storage.fromBlob(value)
+            return None if wkb is None else AsBuilt_Engine.fromWkb([wkb])[0]
+        return value
+
+    def writeValues(self, row):
+        values = []
+        for field, value in zip(self.fields, row):
+            if field.startswith('SHAPE@') and value is not None:
+                value = self.storage.toBlob(value if isinstance(value, (bytes, bytearray, memoryview)) else value.wkb)
+            values.append(value)
+        for field in self.fields[len(values):]:
+            if field == 'DATA_SIZE':
+                values.append(len(values[self.fields.index('DATA')]))
+            else:
+                values.append(f"{{{uuid.uuid4()}}}".upper())
+        return values
+
+
+class GeoPackageSearchCursor(GeoPackageCursor):
+
+    def __init__(self, storage, dataset, fields, where_clause=None, sql_clause=(None, None)):
+        super().__init__(storage, dataset, fields)
+        query = self.selectQuery(self.columns, where_clause)
+        if sql_clause and sql_clause[1]:
+            query += f" {sql_clause[1]}"
+        self.rows = storage.connection.execute(query)
+
+    def __iter__(self):
+        for row in self.rows:
+            yield tuple(self.readValue(field, value) for field, value in zip(self.fields, row))
+
+    def next(self):
+        return next(iter(self))
+
+
+class GeoPackageInsertCursor(GeoPackageCursor):
+
+    def __init__(self, storage, dataset, fields):
+        # The geodatabase fills in DATA_SIZE of an attachment and the GLOBALID of a feature, here they are written
+        # along with the row
+        self.autoFields = []
+        if dataset.endswith('__ATTACH') and 'DATA' in fields and 'DATA_SIZE' not in fields:
+            self.autoFields.append('DATA_SIZE')
+        if 'GLOBALID' in storage.listFields(dataset) and 'GLOBALID' not in fields:
+            self.autoFields.append('GLOBALID')
+        super().__init__(storage, dataset, list(fields) + self.autoFields)
+
+    def insertRow(self, row):
+        query = "INSERT INTO \"{}\" ({}) VALUES ({})".format(self.dataset,
+                                                             ", ".join(f'"{column}"' for column in self.columns),
+                                                             ", ".join('?' * len(self.columns)))
+        return self.storage.connection.execute(query, self.writeValues(row)).lastrowid
+
+
+class GeoPackageUpdateCursor(GeoPackageCursor):
+
+    def __init__(self, storage, dataset, fields, where_clause=None):
+        super().__init__(storage, dataset, fields)
+        self.rows = storage.connection.execute(self.selectQuery(['OBJECTID'] + self.columns, where_clause)).fetchall()
+        self.currentOid = None
+
+    def __iter__(self):
+        for row in self.rows:
+            self.currentOid = row[0]
+            yield [self.readValue(field, value) for field, value in zip(self.fields, row[1:])]
+
+    def updateRow(self, row):
+        query = "UPDATE \"{}\" SET {} WHERE OBJECTID = ?".format(self.dataset,
+                                                                 ", ".join(f'"{column}" = ?' for column in self.columns))
+        self.storage.connection.execute(query, self.writeValues(row) + [self.currentOid])
+
+    def deleteRow(self):
+        query = "DELETE FROM \"{}\" WHERE OBJECTID = ?".format(self.dataset)
+        self.storage.connection.execute(query, [self.currentOid])
@@ -0,0 +1,77 @@
+"""
+Benchmark for the buffering stage of the AsBuilt Polygon tool.  Compares the old one-GeoDataFrame-per-feature
+buffering against the batch buffering in AsBuilt_Engine on synthetic points and lines.
+
+Run from the repository folder:  python benchmarks/bench_buffering.py --sizes 100 1000 10000 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import geopandas
+from shapely.geometry import Point, LineString
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AsBuilt_Engine
+
+# The geopandas reference buffers in the tool's State Plane (feet) coordinate system
+BUFFER_CRS = 'EPSG:2236'
+
+
+def makePoints(count, seed=0):
+    rnd = random.Random(seed)
+    return [Point(rnd.uniform(900000, 950000), rnd.uniform(800000, 850000)) for _ in range(count)]
+
+
+def makeLines(count, vertices=20, seed=0):
+    rnd = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        x, y = rnd.uniform(900000, 950000), rnd.uniform(800000, 850000)
+        coords = []
+        for _ in range(vertices):
+            x += rnd.uniform(-50, 50)
+            y += rnd.uniform(-50, 50)
+            coords.append((x, y))
+        lines.append(LineString(coords))
+    return lines
+
+
+def bufferPerFeature(geometries, buffersize):
+    # The buffering pattern createBuffers used before the batch engine
+    buffers = []
+    for geom in geometries:
+        gdf = geopandas.GeoDataFrame({'SHAPE@': [geom]}, geometry='SHAPE@', crs=BUFFER_CRS)
+        gdf['SHAPE@'] = gdf['SHAPE@'].buffer(int(buffersize))
+        buffers.append(gdf['SHAPE@'].iloc[0])
+    return buffers
+
+
+def timeIt(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--buffersize', type=int, default=10)
+    parser.add_argument('--skip-per-feature', action='store_true',
+                        help="only time the batch engine (the per-feature path is slow at 10k+)")
+    args = parser.parse_args()
+
+    print(f"{'kind':<8}{'features':>10}{'per-feature (s)':>18}{'batch (s)':>12}{'us/feature':>12}")
+    for kind, maker in (('point', makePoints), ('line', makeLines)):
+        for size in args.sizes:
+            geometries = maker(size)
+            batch = timeIt(AsBuilt_Engine.bufferGeometries, geometries, args.buffersize)
+            perFeature = float('nan') if args.skip_per_feature else timeIt(bufferPerFeature, geometries,
+                                                                            args.buffersize)
+            print(f"{kind:<8}{size:>10}{perFeature:>18.3f}{batch:>12.3f}{batch / size * 1e6:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark for the buffer cache of the AsBuilt Polygon tool.  Buffers the same layer three times through the cache:
+cold (every feature buffered and stored), warm (every feature read back), and after a share of the features was
+reshaped, which only buffers those.  Also reports the cache file size per feature.
+
+Run from the repository folder:  python benchmarks/bench_cache.py --sizes 1000 10000 50000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AsBuilt_Cache
+import AsBuilt_Engine
+from bench_buffering import makeLines
+
+
+# return the seconds buffering wkbGeometries took, cache misses are buffered and stored
+def bufferThroughCache(cache, oids, wkbGeometries, buffersize):
+    start = time.perf_counter()
+    keys = [cache.makeKey('bench.gdb\\WaterMains', oid, wkb, buffersize, AsBuilt_Engine.BUFFER_STYLE)
+            for oid, wkb in zip(oids, wkbGeometries)]
+    cached = cache.getMany(keys)
+    missing = [index for index, key in enumerate(keys) if key not in cached]
+    if missing:
+        newWkbs = AsBuilt_Engine.toWkb(AsBuilt_Engine.bufferWkb([wkbGeometries[index] for index in missing], buffersize))
+        cache.putMany([(keys[index], wkb) for index, wkb in zip(missing, newWkbs)])
+        cached.update((keys[index], wkb) for index, wkb in zip(missing, newWkbs))
+    AsBuilt_Engine.fromWkb([cached[key] for key in keys])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--buffersize', type=int, default=10)
+    parser.add_argument('--changed', type=float, default=0.1, help="share of features reshaped before the last run")
+    args = parser.parse_args()
+
+    print(f"{'features':>10}{'no cache (s)':>14}{'cold (s)':>10}{'warm (s)':>10}{'changed (s)':>13}{'bytes/feature':>15}")
+    for size in args.sizes:
+        wkbGeometries = AsBuilt_Engine.toWkb(makeLines(size))
+        oids = list(range(1, size + 1))
+
+        start = time.perf_counter()
+        AsBuilt_Engine.bufferWkb(wkbGeometries, args.buffersize)
+        plainTime = time.perf_counter() - start
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'buffers.sqlite')
+            cache = AsBuilt_Cache.BufferCache(path)
+            coldTime = bufferThroughCache(cache, oids, wkbGeometries, args.buffersize)
+            warmTime = bufferThroughCache(cache, oids, wkbGeometries, args.buffersize)
+
+            changedCount = int(size * args.changed)
+            moved = AsBuilt_Engine.fromWkb(wkbGeometries[:changedCount])
+            wkbGeometries[:changedCount] = AsBuilt_Engine.toWkb(list(shapely.transform(moved, lambda xy: xy + 1)))
+            changedTime = bufferThroughCache(cache, oids, wkbGeometries, args.buffersize)
+            cache.close()
+            bytesPerFeature = os.path.getsize(path) / (size + changedCount)
+
+        print(f"{size:>10,}{plainTime:>14.3f}{coldTime:>10.3f}{warmTime:>10.3f}{changedTime:>13.3f}"
+              f"{bytesPerFeature:>15,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark for the in-memory dissolve of the AsBuilt Polygon tool.  Times AsBuilt_Engine.dissolveBuffers against a
+GeoDataFrame.dissolve reference on the same buffers and checks the two results are geometrically equivalent.
+
+Run from the repository folder:  python benchmarks/bench_dissolve.py --sizes 100 1000 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+import geopandas
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AsBuilt_Engine
+from bench_buffering import BUFFER_CRS, makeLines
+
+
+def makeBufferRows(count, buffersize):
+    rows = []
+    for index, bufferPoly in enumerate(AsBuilt_Engine.bufferGeometries(makeLines(count), buffersize)):
+        row = {field: 'No' for field in AsBuilt_Engine.DISSOLVE_FIELDS}
+        row['HYPERLINK'] = '..\\originals\\P56\\1234567.pdf'
+        row['WATER'] = 'Yes' if index % 2 else 'No'
+        row['SHAPE@'] = bufferPoly
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--buffersize', type=int, default=10)
+    parser.add_argument('--tolerance', type=float, default=1e-6,
+                        help="largest symmetric difference area, as a share of the reference area")
+    args = parser.parse_args()
+
+    print(f"{'buffers':>10}{'reference (s)':>16}{'in-memory (s)':>16}{'groups':>8}{'equivalent':>12}")
+    for size in args.sizes:
+        bufferRows = makeBufferRows(size, args.buffersize)
+
+        start = time.perf_counter()
+        dissolvedRows = AsBuilt_Engine.dissolveBuffers(bufferRows)
+        inMemory = time.perf_counter() - start
+
+        start = time.perf_counter()
+        gdf = geopandas.GeoDataFrame(bufferRows, geometry='SHAPE@', crs=BUFFER_CRS)
+        reference = gdf.dissolve(by=AsBuilt_Engine.DISSOLVE_FIELDS).reset_index()
+        referenceTime = time.perf_counter() - start
+
+        equivalent = len(reference) == len(dissolvedRows)
+        for row in dissolvedRows:
+            match = reference[reference['WATER'] == row['WATER']].geometry.iloc[0]
+            difference = match.symmetric_difference(row['SHAPE@']).area
+            equivalent = equivalent and difference <= args.tolerance * match.area
+        print(f"{size:>10}{referenceTime:>16.3f}{inMemory:>16.3f}{len(dissolvedRows):>8}{str(equivalent):>12}")
+
+
+if __name__ == '__main__':
+    main()
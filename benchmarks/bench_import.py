@@ -0,0 +1,47 @@
+"""
+Import-time benchmark for the AsBuilt Polygon tool.  Each case imports modules in a fresh interpreter and reports the
+median wall time, so the startup cost of the tool's own modules can be compared with the geopandas import the tool
+used to do at load time.  arcpy is left out, it is only available inside ArcGIS Pro.
+
+Run from the repository folder:  python benchmarks/bench_import.py --repeat 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ("tool startup (metrics, storage, stages, cache)",
+     "import AsBuilt_Metrics, AsBuilt_Storage, AsBuilt_Stages, AsBuilt_Cache"),
+    ("buffering stage (engine: shapely, numpy)", "import AsBuilt_Engine"),
+    ("old startup (geopandas, shapely)", "import geopandas, shapely.geometry"),
+]
+
+
+# return seconds taken by the imports in a new interpreter
+def importTime(statement):
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'case':<50}{'median (s)':>12}{'min (s)':>10}")
+    for name, statement in CASES:
+        try:
+            times = [importTime(statement) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError as e:
+            print(f"{name:<50}{'failed: ' + e.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{name:<50}{statistics.median(times):>12.3f}{min(times):>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
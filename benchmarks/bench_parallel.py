@@ -0,0 +1,72 @@
+"""
+Benchmark for the parallel buffer and dissolve stages of the AsBuilt Polygon tool.  Times AsBuilt_Engine.bufferWkb
+followed by AsBuilt_Engine.dissolveBuffers against AsBuilt_Engine.bufferDissolveWkb, which buffers and pre-unions each
+chunk in the same worker, serially and with a process pool on synthetic lines.  Also times starting the pool, the
+cost a pooled stage pays before any geometry work; --start-method spawn measures it the way Windows starts workers.
+
+Run from the repository folder:  python benchmarks/bench_parallel.py --sizes 10000 50000 --workers 4 8
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AsBuilt_Engine
+from bench_buffering import makeLines
+
+
+def runStages(wkbGeometries, buffersize, workers):
+    start = time.perf_counter()
+    buffers = AsBuilt_Engine.bufferWkb(wkbGeometries, buffersize, workers)
+    bufferTime = time.perf_counter() - start
+
+    bufferRows = []
+    for bufferPoly in buffers:
+        row = {field: 'No' for field in AsBuilt_Engine.DISSOLVE_FIELDS}
+        row['SHAPE@'] = bufferPoly
+        bufferRows.append(row)
+    start = time.perf_counter()
+    AsBuilt_Engine.dissolveBuffers(bufferRows)
+    dissolveTime = time.perf_counter() - start
+
+    for row, wkb in zip(bufferRows, wkbGeometries):
+        row['SHAPE@WKB'] = wkb
+    start = time.perf_counter()
+    AsBuilt_Engine.bufferDissolveWkb(bufferRows, buffersize, workers)
+    return bufferTime, dissolveTime, time.perf_counter() - start
+
+
+# return seconds to start a pool of workers and have each of them run a task
+def poolStartup(workers):
+    start = time.perf_counter()
+    with AsBuilt_Engine.processPool(workers) as pool:
+        list(pool.map(abs, range(workers)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4])
+    parser.add_argument('--buffersize', type=int, default=10)
+    parser.add_argument('--start-method', choices=multiprocessing.get_all_start_methods())
+    args = parser.parse_args()
+    if args.start_method:
+        multiprocessing.set_start_method(args.start_method)
+
+    print(f"{os.cpu_count()} CPUs, pool start ({multiprocessing.get_start_method()}): " +
+          ", ".join(f"{workers} workers {poolStartup(workers):.3f} s" for workers in args.workers))
+
+    print(f"{'features':>10}{'workers':>9}{'buffer (s)':>12}{'dissolve (s)':>14}{'combined (s)':>14}")
+    for size in args.sizes:
+        wkbGeometries = AsBuilt_Engine.toWkb(makeLines(size))
+        for workers in [1] + args.workers:
+            bufferTime, dissolveTime, combinedTime = runStages(wkbGeometries, args.buffersize, workers)
+            used = AsBuilt_Engine.poolWorkers(size, workers)
+            print(f"{size:>10}{used:>9}{bufferTime:>12.3f}{dissolveTime:>14.3f}{combinedTime:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark for the selection to query translation of the AsBuilt Polygon tool.  For contiguous, random and clustered
+selections of increasing size, compares one 'OBJECTID IN (...)' clause (what the tool used to build from FIDSet) with
+AsBuilt_Storage.oidWhereClauses: clause count, SQL length, build time and read time on a GeoPackage layer.
+
+Run from the repository folder:  python benchmarks/bench_selection.py --sizes 100 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AsBuilt_Storage
+
+
+# return dict of pattern name -> selected OIDs out of a layer of total features
+def makeSelections(size, total, seed=0):
+    rnd = random.Random(seed)
+    clustered = set()
+    while len(clustered) < size:
+        start = rnd.randint(1, total - 50)
+        clustered.update(range(start, start + rnd.randint(5, 50)))
+    return {'contiguous': list(range(1, size + 1)),
+            'random': rnd.sample(range(1, total + 1), size),
+            'clustered': sorted(clustered)[:size]}
+
+
+# return (seconds, rows) to read the selected rows with each clause
+def readTime(storage, clauses):
+    start = time.perf_counter()
+    rows = 0
+    for clause in clauses:
+        with storage.searchCursor('wMain', ['OID@', 'SHAPE@WKB'], where_clause=clause) as cursor:
+            rows += sum(1 for _ in cursor)
+    return time.perf_counter() - start, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    args = parser.parse_args()
+
+    total = max(args.sizes) * 3
+    with tempfile.TemporaryDirectory() as folder:
+        storage = AsBuilt_Storage.GeoPackageStorage(os.path.join(folder, 'selection.gpkg'))
+        storage.createLayer('wMain', 'POINT', [])
+        point = bytes.fromhex('0101000000000000000000f03f000000000000f03f')
+        with storage.editor(storage.path):
+            storage.connection.executemany('INSERT INTO wMain (SHAPE) VALUES (?)',
+                                           [(storage.toBlob(point),)] * total)
+
+        print(f"{'pattern':<12}{'OIDs':>8}{'query':>8}{'clauses':>9}{'SQL chars':>11}{'build (s)':>11}{'read (s)':>10}")
+        for size in args.sizes:
+            for pattern, oids in makeSelections(size, total).items():
+                start = time.perf_counter()
+                single = ["OBJECTID IN ({0})".format(",".join(str(oid) for oid in oids))]
+                singleBuild = time.perf_counter() - start
+                start = time.perf_counter()
+                chunked = AsBuilt_Storage.oidWhereClauses(oids)
+                chunkedBuild = time.perf_counter() - start
+
+                for name, clauses, build in (('single', single, singleBuild), ('chunked', chunked, chunkedBuild)):
+                    seconds, rows = readTime(storage, clauses)
+                    assert rows == len(set(oids))
+                    print(f"{pattern:<12}{size:>8}{name:>8}{len(clauses):>9}{sum(map(len, clauses)):>11}"
+                          f"{build:>11.4f}{seconds:>10.3f}")
+        storage.connection.close()
+
+
+if __name__ == '__main__':
+    main()
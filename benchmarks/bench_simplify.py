@@ -0,0 +1,71 @@
+"""
+Benchmark for buffer resolution and output simplification in the AsBuilt Polygon tool.  For each buffer resolution
+(quad_segs) and simplify factor (tolerance = factor * buffer size) it reports the dissolved vertex count, dissolve and
+GeoPackage insert time, and fidelity: the symmetric difference with the full resolution, unsimplified polygons as a
+share of their area.
+
+Run from the repository folder:  python benchmarks/bench_simplify.py --features 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AsBuilt_Engine
+import AsBuilt_Storage
+from bench_buffering import makeLines
+
+
+# return dissolved rows and the seconds the dissolve (and simplify) took
+def dissolve(geometries, buffersize, quadSegs, simplifyFactor):
+    bufferStyle = dict(AsBuilt_Engine.BUFFER_STYLE, quad_segs=quadSegs)
+    bufferRows = []
+    for bufferPoly in AsBuilt_Engine.bufferGeometries(geometries, buffersize, bufferStyle):
+        row = {field: 'No' for field in AsBuilt_Engine.DISSOLVE_FIELDS}
+        row['SHAPE@'] = bufferPoly
+        bufferRows.append(row)
+    start = time.perf_counter()
+    dissolvedRows = AsBuilt_Engine.dissolveBuffers(bufferRows)
+    AsBuilt_Engine.simplifyRows(dissolvedRows, simplifyFactor * buffersize)
+    return dissolvedRows, time.perf_counter() - start
+
+
+def insertTime(storage, dissolvedRows):
+    fields = AsBuilt_Engine.DISSOLVE_FIELDS
+    storage.createLayer('Asbuilt_Polygons', 'MULTIPOLYGON', [(field, 'TEXT') for field in fields])
+    start = time.perf_counter()
+    with storage.editor(storage.path):
+        with storage.insertCursor('Asbuilt_Polygons', fields + ['SHAPE@WKB']) as cursor:
+            for row in dissolvedRows:
+                cursor.insertRow([row[field] for field in fields] + [row['SHAPE@'].wkb])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--features', type=int, default=2000)
+    parser.add_argument('--buffersize', type=int, default=10)
+    parser.add_argument('--quad-segs', type=int, nargs='+', default=[16, 8, 4])
+    parser.add_argument('--factors', type=float, nargs='+', default=[0, 0.02, 0.05, 0.1, 0.25])
+    args = parser.parse_args()
+
+    geometries = makeLines(args.features)
+    reference = dissolve(geometries, args.buffersize, 16, 0)[0][0]['SHAPE@']
+
+    print(f"{'quad_segs':>10}{'factor':>8}{'vertices':>10}{'dissolve (s)':>14}{'insert (s)':>12}{'area error':>12}")
+    with tempfile.TemporaryDirectory() as folder:
+        storage = AsBuilt_Storage.GeoPackageStorage(os.path.join(folder, 'simplify.gpkg'))
+        for quadSegs in args.quad_segs:
+            for factor in args.factors:
+                dissolvedRows, dissolveTime = dissolve(geometries, args.buffersize, quadSegs, factor)
+                geometry = dissolvedRows[0]['SHAPE@']
+                error = reference.symmetric_difference(geometry).area / reference.area
+                print(f"{quadSegs:>10}{factor:>8}{AsBuilt_Engine.countVertices([geometry]):>10,}"
+                      f"{dissolveTime:>14.3f}{insertTime(storage, dissolvedRows):>12.3f}{error:>12.4%}")
+        storage.connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Stage benchmark for the AsBuilt Polygon tool on the GeoPackage storage backend.  Generates synthetic point and line
+layers and times each stage of do_stuff (update, buffer, dissolve, insert, attach) by running the tool's own stage
+functions from AsBuilt_Stages, so regressions show up without ArcGIS Pro.
+
+Run from the repository folder:  python benchmarks/bench_stages.py --sizes 100 1000 10000 100000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AsBuilt_Engine
+import AsBuilt_Stages
+import AsBuilt_Storage
+from bench_buffering import makePoints, makeLines
+
+PRODUCTION_FIELDS = [('SOURCE', 'TEXT'), ('ASBUILTDATE', 'TEXT'), ('WATERTYPE', 'TEXT')]
+WATER_TYPES = ['Potable', 'Sewage', 'Reclaimed', 'Raw', 'Treated']
+
+
+class QuietMessages:
+    # The stage messages and prints would drown out the table, only warnings are shown
+
+    @staticmethod
+    def AddMessage(message):
+        pass
+
+    @staticmethod
+    def AddWarning(message):
+        print(f"WARNING: {message}")
+
+
+# return storage with a point layer, a line layer and an as-built polygon layer of count features each
+def makeGeoPackage(path, count, seed=0):
+    storage = AsBuilt_Storage.GeoPackageStorage(path)
+    rnd = random.Random(seed)
+    for name, geometryType, geometries in (('wFitting', 'POINT', makePoints(count, seed)),
+                                           ('wMain', 'LINESTRING', makeLines(count, seed=seed))):
+        storage.createLayer(name, geometryType, PRODUCTION_FIELDS)
+        with storage.editor(path):
+            with storage.insertCursor(name, ['SHAPE@WKB', 'WATERTYPE']) as cursor:
+                for geometry in geometries:
+                    cursor.insertRow([geometry.wkb, rnd.choice(WATER_TYPES)])
+        storage.select(name, range(1, count + 1))
+
+    polygonFields = [(field, 'TEXT') for field in AsBuilt_Engine.DISSOLVE_FIELDS]
+    storage.createLayer('Asbuilt_Polygons', 'MULTIPOLYGON', polygonFields + [('GLOBALID', 'TEXT'),
+                                                                            ('created_date', 'TEXT')])
+    return storage
+
+
+# return dict of stage name -> seconds for one run of the tool's stages
+def runStages(storage, selLayers, buffersize, attachment, inMemoryDissolve=False, workers=1):
+    run = AsBuilt_Stages.AsBuiltRun(storage, QuietMessages, buffersize=buffersize, scratchWorkspace=storage.path,
+                                    template='Asbuilt_Polygons', inMemoryDissolve=inMemoryDissolve, workers=workers)
+    with contextlib.redirect_stdout(io.StringIO()):
+        run.setInputs(attachment, '01/31/2024 12:00:00 AM', '')
+        AsBuilt_Stages.runStages(run, selLayers, 'Asbuilt_Polygons', addAttach=1)
+    # With workers and an in-memory dissolve the buffering is timed as part of the dissolve
+    return {record['stage']: record['seconds'] for record in run.metrics.stages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--buffersize', type=int, default=10)
+    parser.add_argument('--attachment-mb', type=int, default=5)
+    parser.add_argument('--in-memory-dissolve', action='store_true')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    stages = ['updateSelected', 'createBuffers.buffer', 'createBuffers.dissolve', 'addNewPolygons', 'addAttachment']
+    print(f"{'features':>10}" + "".join(f"{stage.split('.')[-1]:>16}" for stage in stages))
+    with tempfile.TemporaryDirectory() as folder:
+        # The tool builds the hyperlink from the part of the path from 'originals' on
+        attachment = os.path.join(folder, 'originals', 'P56', '1234567.pdf')
+        os.makedirs(os.path.dirname(attachment))
+        with open(attachment, 'wb') as file:
+            file.write(os.urandom(args.attachment_mb * 1024 * 1024))
+
+        for size in args.sizes:
+            storage = makeGeoPackage(os.path.join(folder, f'bench_{size}.gpkg'), size)
+            timings = runStages(storage, ['wFitting', 'wMain'], args.buffersize, attachment,
+                                args.in_memory_dissolve, args.workers)
+            print(f"{size * 2:>10}" + "".join(f"{timings.get(stage, 0.0):>16.3f}" for stage in stages))
+            # A second run over the same selection, updateSelected has nothing left to write
+            timings = runStages(storage, ['wFitting', 'wMain'], args.buffersize, attachment,
+                                args.in_memory_dissolve, args.workers)
+            storage.connection.close()
+            print(f"{'re-run':>10}" + "".join(f"{timings.get(stage, 0.0):>16.3f}" for stage in stages))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AsBuilt_Engine
+import AsBuilt_Stages
+import AsBuilt_Storage
+
+
+class QuietMessages:
+
+    @staticmethod
+    def AddMessage(message):
+        pass
+
+    @staticmethod
+    def AddWarning(message):
+        pass
+
+
+# return a GeoPackage with a water main layer of three lines and an empty as-built polygon layer
+@pytest.fixture
+def storage(tmp_path):
+    storage = AsBuilt_Storage.GeoPackageStorage(str(tmp_path / 'asbuilt.gpkg'))
+    storage.createLayer('wMain', 'LINESTRING', [('SOURCE', 'TEXT'), ('ASBUILTDATE', 'TEXT'), ('WATERTYPE', 'TEXT')])
+    with storage.editor(storage.path):
+        with storage.insertCursor('wMain', ['SHAPE@WKB', 'WATERTYPE']) as cursor:
+            for offset in (0, 500, 1000):
+                cursor.insertRow([shapely.LineString([(offset, 0), (offset + 100, 0)]).wkb, 'Potable'])
+    polygonFields = [(field, 'TEXT') for field in AsBuilt_Engine.DISSOLVE_FIELDS]
+    storage.createLayer('Asbuilt_Polygons', 'MULTIPOLYGON', polygonFields + [('GLOBALID', 'TEXT')])
+    yield storage
+    storage.connection.close()
+
+
+# return an AsBuiltRun on storage that keeps its messages to itself
+@pytest.fixture
+def run(storage):
+    return AsBuilt_Stages.AsBuiltRun(storage, QuietMessages, scratchWorkspace=storage.path,
+                                     template='Asbuilt_Polygons', inMemoryDissolve=True)
+
+
+# return the path of a scanned as-built under an 'originals' folder, the tool builds the hyperlink from it
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'originals' / 'P56' / '1234567.pdf'
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b'%PDF-1.4 as-built scan')
+    return str(path)
@@ -0,0 +1,92 @@
+import json
+
+import AsBuilt_Batch
+import AsBuilt_Cache
+
+
+def writeManifest(tmp_path, source, oids):
+    manifestPath = tmp_path / 'manifest.csv'
+    manifestPath.write_text("source,date,wudnum,buffersize,attach,layer,oids,where\n"
+                            f"{source},01/31/2024,WUD-1,10,1,wMain,{oids},\n")
+    return str(manifestPath)
+
+
+def countRows(storage, table):
+    return storage.connection.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+
+
+def test_manifest_runs_on_geopackage(tmp_path, storage, run, source):
+    manifestPath = writeManifest(tmp_path, source, '1;2')
+    statePath = str(tmp_path / 'state.jsonl')
+    layers = {'wMain': 'wMain'}
+
+    results = AsBuilt_Batch.runManifest(run, manifestPath, statePath, layers, 'Asbuilt_Polygons', 10, 1)
+
+    assert results == {'ok': 1, 'failed': 0, 'skipped': 0}
+    assert storage.connection.execute("SELECT COUNT(*) FROM wMain WHERE SOURCE IS NOT NULL").fetchone()[0] == 2
+    assert countRows(storage, 'Asbuilt_Polygons') == 1
+    assert countRows(storage, 'Asbuilt_Polygons__ATTACH') == 1
+
+    # A second run of the same manifest skips the finished entry
+    results = AsBuilt_Batch.runManifest(run, manifestPath, statePath, layers, 'Asbuilt_Polygons', 10, 1)
+    assert results == {'ok': 0, 'failed': 0, 'skipped': 1}
+    assert countRows(storage, 'Asbuilt_Polygons') == 1
+
+
+def test_failed_entry_resumes_after_its_last_stage(tmp_path, storage, run, source):
+    manifestPath = writeManifest(tmp_path, source, '1;2;3')
+    statePath = str(tmp_path / 'state.jsonl')
+    layers = {'wMain': 'wMain'}
+    scan = (tmp_path / 'originals' / 'P56' / '1234567.pdf').read_bytes()
+
+    # The scan can't be read when the attachment is added, after the polygons were committed
+    (tmp_path / 'originals' / 'P56' / '1234567.pdf').unlink()
+    results = AsBuilt_Batch.runManifest(run, manifestPath, statePath, layers, 'Asbuilt_Polygons', 10, 1)
+    assert results['failed'] == 1
+    assert countRows(storage, 'Asbuilt_Polygons') == 1
+    lastRecord = json.loads(open(statePath).read().splitlines()[-1])
+    assert lastRecord['completed'] == ['updateSelected', 'addNewPolygons']
+
+    (tmp_path / 'originals' / 'P56' / '1234567.pdf').write_bytes(scan)
+    results = AsBuilt_Batch.runManifest(run, manifestPath, statePath, layers, 'Asbuilt_Polygons', 10, 1)
+    assert results['ok'] == 1
+    # The polygons are not inserted a second time, the attachment goes on the ones the first run made
+    assert countRows(storage, 'Asbuilt_Polygons') == 1
+    polygonGlobalId = storage.connection.execute("SELECT GLOBALID FROM Asbuilt_Polygons").fetchone()[0]
+    assert storage.connection.execute("SELECT REL_GLOBALID FROM Asbuilt_Polygons__ATTACH").fetchall() == \
+        [(polygonGlobalId,)]
+
+
+def test_retry_before_the_polygons_were_recorded_merges(tmp_path, storage, run, source):
+    manifestPath = writeManifest(tmp_path, source, '1')
+    statePath = str(tmp_path / 'state.jsonl')
+    layers = {'wMain': 'wMain'}
+    AsBuilt_Batch.runManifest(run, manifestPath, statePath, layers, 'Asbuilt_Polygons', 10, 1)
+
+    # As if the process died right after addNewPolygons committed, before its progress was written
+    with open(statePath, 'a') as stateFile:
+        stateFile.write(json.dumps({'source': source, 'status': 'running', 'completed': ['updateSelected']}) + '\n')
+    results = AsBuilt_Batch.runManifest(run, manifestPath, statePath, layers, 'Asbuilt_Polygons', 10, 1)
+
+    assert results['ok'] == 1
+    assert countRows(storage, 'Asbuilt_Polygons') == 1
+    assert run.incrementalMode is False
+
+
+def test_cache_stats_are_per_entry(tmp_path, storage, run, source):
+    # Two as-builts over the same mains, the second entry's buffers all come out of the cache
+    secondSource = tmp_path / 'originals' / 'P56' / '7654321.pdf'
+    secondSource.write_bytes(b'%PDF-1.4 second scan')
+    manifestPath = tmp_path / 'manifest.csv'
+    manifestPath.write_text("source,date,wudnum,buffersize,attach,layer,oids,where\n"
+                            f"{source},01/31/2024,WUD-1,10,0,wMain,1;2,\n"
+                            f"{secondSource},02/29/2024,WUD-2,10,0,wMain,1;2,\n")
+    statePath = str(tmp_path / 'state.jsonl')
+    run.bufferCache = AsBuilt_Cache.BufferCache(str(tmp_path / 'buffers.sqlite'))
+
+    AsBuilt_Batch.runManifest(run, str(manifestPath), statePath, {'wMain': 'wMain'}, 'Asbuilt_Polygons', 10, 0)
+    run.bufferCache.close()
+
+    records = [json.loads(line) for line in open(statePath).read().splitlines() if '"ok"' in line]
+    assert [record['bufferCache']['misses'] for record in records] == [2, 0]
+    assert [record['bufferCache']['hits'] for record in records] == [0, 2]
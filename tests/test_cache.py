@@ -0,0 +1,36 @@
+import itertools
+
+import AsBuilt_Cache
+
+
+def test_evict_drops_least_recently_used(tmp_path, monkeypatch):
+    clock = itertools.count(1)
+    monkeypatch.setattr(AsBuilt_Cache.time, 'time', lambda: next(clock))
+    cache = AsBuilt_Cache.BufferCache(str(tmp_path / 'buffers.sqlite'), maxBytes=300)
+    for key in ('a', 'b', 'c'):
+        cache.putMany([(key, b'x' * 100)])
+
+    # Reading 'a' makes it the most recently used, the next insert goes over the limit and evicts 'b' and 'c'
+    assert cache.getMany(['a']) == {'a': b'x' * 100}
+    cache.putMany([('d', b'x' * 100)])
+
+    assert sorted(cache.getMany(['a', 'b', 'c', 'd'])) == ['a', 'd']
+    assert (cache.hits, cache.misses) == (3, 2)
+    cache.close()
+
+
+def test_under_the_limit_nothing_is_evicted(tmp_path):
+    cache = AsBuilt_Cache.BufferCache(str(tmp_path / 'buffers.sqlite'), maxBytes=1000)
+    cache.putMany([(key, b'x' * 100) for key in 'abc'])
+    assert len(cache.getMany(list('abc'))) == 3
+    cache.close()
+
+
+def test_key_changes_with_geometry_and_settings():
+    style = {'quad_segs': 16, 'cap_style': 'round', 'join_style': 'round'}
+    key = AsBuilt_Cache.BufferCache.makeKey('C:\\GIS\\wMain', 1, b'wkb', 10, style)
+
+    assert key == AsBuilt_Cache.BufferCache.makeKey('c:\\gis\\WMAIN', 1, b'wkb', 10, dict(reversed(style.items())))
+    assert key != AsBuilt_Cache.BufferCache.makeKey('C:\\GIS\\wMain', 1, b'reshaped', 10, style)
+    assert key != AsBuilt_Cache.BufferCache.makeKey('C:\\GIS\\wMain', 1, b'wkb', 20, style)
+    assert key != AsBuilt_Cache.BufferCache.makeKey('C:\\GIS\\wMain', 1, b'wkb', 10, dict(style, cap_style='flat'))
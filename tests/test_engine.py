@@ -0,0 +1,142 @@
+import pytest
+import shapely
+
+import AsBuilt_Engine
+
+
+# return a polygon row of the as-built, water type flags 'No' and the first run's date unless given
+def polygonRow(geometry, oid=None, **fields):
+    row = {field: 'No' for field in AsBuilt_Engine.DISSOLVE_FIELDS}
+    row.update(PBCWUDFILE='1234567.pdf', HYPERLINK='..\\originals\\P56\\1234567.pdf', P56FOLDER='P56',
+               ASBUILTNO='1234567', ASBUILTDATE='01/31/2024', WUDPROJECTNUM='WUD-1')
+    row.update(fields)
+    row['SHAPE@'] = geometry
+    if oid is not None:
+        row['OID@'] = oid
+    return row
+
+
+def test_new_polygon_merges_every_existing_polygon_it_overlaps():
+    existingRows = [polygonRow(shapely.box(10, 0, 20, 10), oid=5, SEWER='Yes'),
+                    polygonRow(shapely.box(0, 0, 10, 10), oid=3),
+                    polygonRow(shapely.box(100, 0, 110, 10), oid=4)]
+    newRows = [polygonRow(shapely.box(5, 0, 15, 10), WATER='Yes')]
+
+    updatedRows, insertRows, deletedOids = AsBuilt_Engine.mergeIntoExisting(newRows, existingRows,
+                                                                            deleteMerged=True)
+
+    assert insertRows == []
+    assert deletedOids == [5]
+    assert len(updatedRows) == 1
+    merged = updatedRows[0]
+    assert merged['OID@'] == 3
+    assert merged['SHAPE@'].equals(shapely.box(0, 0, 20, 10))
+    assert (merged['WATER'], merged['SEWER'], merged['RAW']) == ('Yes', 'Yes', 'No')
+
+
+def test_new_polygons_that_bridge_groups_join_them():
+    existingRows = [polygonRow(shapely.box(0, 0, 10, 10), oid=1),
+                    polygonRow(shapely.box(40, 0, 50, 10), oid=2)]
+    # The first two only reach one existing polygon each, the third reaches both
+    newRows = [polygonRow(shapely.box(5, 0, 15, 10)),
+               polygonRow(shapely.box(35, 0, 45, 10)),
+               polygonRow(shapely.box(8, 0, 42, 10))]
+
+    updatedRows, insertRows, deletedOids = AsBuilt_Engine.mergeIntoExisting(newRows, existingRows,
+                                                                            deleteMerged=True)
+
+    assert insertRows == []
+    assert deletedOids == [2]
+    assert [row['OID@'] for row in updatedRows] == [1]
+    assert updatedRows[0]['SHAPE@'].equals(shapely.box(0, 0, 50, 10))
+
+
+def test_without_delete_merged_other_overlapped_polygons_are_only_reported():
+    existingRows = [polygonRow(shapely.box(10, 0, 20, 10), oid=5, SEWER='Yes'),
+                    polygonRow(shapely.box(0, 0, 10, 10), oid=3)]
+    newRows = [polygonRow(shapely.box(5, 0, 15, 10))]
+
+    updatedRows, insertRows, overlappingOids = AsBuilt_Engine.mergeIntoExisting(newRows, existingRows)
+
+    assert overlappingOids == [5]
+    assert [row['OID@'] for row in updatedRows] == [3]
+    # OID 5 keeps its own shape and flags, only the new polygon goes into OID 3
+    assert updatedRows[0]['SHAPE@'].equals(shapely.box(0, 0, 15, 10))
+    assert updatedRows[0]['SEWER'] == 'No'
+
+
+def test_merged_polygon_takes_the_new_date_and_project_number():
+    existingRows = [polygonRow(shapely.box(0, 0, 10, 10), oid=1, WATER='Yes')]
+    newRows = [polygonRow(shapely.box(5, 0, 15, 10), ASBUILTDATE='02/15/2024', WUDPROJECTNUM='WUD-2', RAW='Yes')]
+
+    updatedRows, insertRows, overlappingOids = AsBuilt_Engine.mergeIntoExisting(newRows, existingRows)
+
+    merged = updatedRows[0]
+    assert (merged['OID@'], merged['ASBUILTDATE'], merged['WUDPROJECTNUM']) == (1, '02/15/2024', 'WUD-2')
+    assert (merged['WATER'], merged['RAW']) == ('Yes', 'Yes')
+
+
+def test_other_as_builts_and_distant_polygons_are_left_alone():
+    existingRows = [polygonRow(shapely.box(0, 0, 10, 10), oid=1, ASBUILTNO='7654321')]
+    newRows = [polygonRow(shapely.box(5, 0, 15, 10)), polygonRow(shapely.box(100, 0, 110, 10))]
+
+    updatedRows, insertRows, deletedOids = AsBuilt_Engine.mergeIntoExisting(newRows, existingRows)
+
+    assert (updatedRows, deletedOids) == ([], [])
+    assert insertRows == newRows
+
+
+def test_nothing_existing_inserts_everything():
+    newRows = [polygonRow(shapely.box(0, 0, 10, 10))]
+    assert AsBuilt_Engine.mergeIntoExisting(newRows, []) == ([], newRows, [])
+
+
+FLAT_STYLE = {'quad_segs': 16, 'cap_style': 'flat', 'join_style': 'round'}
+
+
+def test_flat_caps_leave_points_round_and_lines_flat():
+    point, multipoint, line = (shapely.Point(0, 0), shapely.MultiPoint([(100, 0), (200, 0)]),
+                               shapely.LineString([(0, 50), (10, 50)]))
+
+    pointBuffer, multipointBuffer, lineBuffer = AsBuilt_Engine.bufferGeometries([point, multipoint, line], 5,
+                                                                                FLAT_STYLE)
+
+    assert pointBuffer.equals(shapely.buffer(point, 5, quad_segs=16))
+    assert shapely.get_num_coordinates(pointBuffer) == 65
+    assert multipointBuffer.equals(shapely.buffer(multipoint, 5, quad_segs=16))
+    assert lineBuffer.equals(shapely.box(0, 45, 10, 55))
+
+
+def test_round_caps_buffer_points_unchanged():
+    point = shapely.Point(0, 0)
+    assert AsBuilt_Engine.bufferGeometries([point], 5)[0].equals(shapely.buffer(point, 5, quad_segs=16))
+
+
+WKB_SAMPLES = ['POINT (1 2)', 'POINT Z (1 2 3)', 'POINT M (1 2 4)', 'POINT ZM (1 2 3 4)', 'POINT EMPTY',
+               'LINESTRING (0 0, 1 1, 2 0)', 'LINESTRING Z (0 0 0, 1 1 1)', 'LINESTRING M (0 0 1, 1 1 2)',
+               'LINESTRING EMPTY', 'POLYGON ((0 0, 4 0, 4 4, 0 0), (1 1, 2 1, 2 2, 1 1))',
+               'MULTIPOINT ((0 0), (1 1))', 'MULTILINESTRING ((0 0, 1 1), (2 2, 3 3, 4 4))',
+               'MULTIPOLYGON Z (((0 0 1, 1 0 1, 1 1 1, 0 0 1)), ((5 5 2, 6 5 2, 6 6 2, 5 5 2)))',
+               'GEOMETRYCOLLECTION (POINT (1 1), LINESTRING (0 0, 1 1), POLYGON EMPTY)',
+               'GEOMETRYCOLLECTION ZM (POINT ZM (1 1 1 1), MULTILINESTRING ZM ((0 0 0 0, 1 1 1 1)))']
+
+
+@pytest.mark.parametrize('wkt', WKB_SAMPLES)
+@pytest.mark.parametrize('flavor', ['extended', 'iso'])
+@pytest.mark.parametrize('byteOrder', [0, 1])
+def test_wkb_vertex_count_matches_shapely(wkt, flavor, byteOrder):
+    geometry = shapely.from_wkt(wkt)
+    wkb = shapely.to_wkb(geometry, flavor=flavor, byte_order=byteOrder, output_dimension=4)
+    assert AsBuilt_Engine.countWkbVertices([wkb]) == shapely.get_num_coordinates(geometry)
+
+
+def test_wkb_vertex_count_skips_the_srid():
+    geometry = shapely.set_srid(shapely.from_wkt('LINESTRING (0 0, 1 1, 2 2)'), 2236)
+    assert AsBuilt_Engine.countWkbVertices([shapely.to_wkb(geometry, include_srid=True)]) == 3
+
+
+def test_wkb_vertex_count_rejects_curves():
+    # CircularString is type 8, shapely can't decode it either
+    wkb = shapely.to_wkb(shapely.from_wkt('LINESTRING (0 0, 1 1, 2 0)'), flavor='iso', byte_order=1)
+    with pytest.raises(ValueError):
+        AsBuilt_Engine.countWkbVertices([wkb[:1] + (8).to_bytes(4, 'little') + wkb[5:]])
@@ -0,0 +1,29 @@
+import AsBuilt_Metrics
+
+
+def test_stage_records_peak_rise_and_resident_change(monkeypatch):
+    # A stage that allocates 2 GB and frees it again: resident memory is back where it was, the peak went up
+    peaks = iter([4000, 6000])
+    resident = iter([3000, 3000])
+    monkeypatch.setattr(AsBuilt_Metrics, 'peakRssBytes', lambda: next(peaks) * 1048576)
+    monkeypatch.setattr(AsBuilt_Metrics, 'rssBytes', lambda: next(resident) * 1048576)
+    metrics = AsBuilt_Metrics.RunMetrics()
+
+    with metrics.stage('addAttachment'):
+        pass
+
+    assert metrics.stages[0]['peakRiseMB'] == 2000.0
+    assert metrics.stages[0]['rssDeltaMB'] == 0.0
+    assert metrics.summary()[1] == "  addAttachment: 0.00 s, peak +2,000.0 MB, +0.0 MB resident"
+
+
+def test_stage_without_memory_readings(monkeypatch):
+    monkeypatch.setattr(AsBuilt_Metrics, 'peakRssBytes', lambda: None)
+    monkeypatch.setattr(AsBuilt_Metrics, 'rssBytes', lambda: None)
+    metrics = AsBuilt_Metrics.RunMetrics()
+
+    with metrics.stage('read'):
+        metrics.count('rows', 3)
+
+    assert 'peakRiseMB' not in metrics.stages[0]
+    assert metrics.summary()[1] == "  read: 0.00 s, 3 rows"
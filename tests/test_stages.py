@@ -0,0 +1,153 @@
+import datetime
+
+import shapely
+
+import AsBuilt_Engine
+import AsBuilt_Stages
+
+
+# Two polygons an earlier run left for the same as-built, the buffers of mains 1 and 2 overlap both
+def insertEarlierPolygons(storage, run):
+    fields = AsBuilt_Engine.DISSOLVE_FIELDS + ['SHAPE@WKB']
+    with storage.editor(storage.path):
+        with storage.insertCursor('Asbuilt_Polygons', fields) as cursor:
+            for geometry in (shapely.box(-20, -20, 50, 20), shapely.box(450, -20, 650, 20)):
+                row = polygonValues(run)
+                cursor.insertRow([row[field] for field in AsBuilt_Engine.DISSOLVE_FIELDS] + [geometry.wkb])
+
+
+def test_incremental_run_with_delete_merged_leaves_one_row(storage, run, source):
+    run.setInputs(source, '01/31/2024', 'WUD-1')
+    insertEarlierPolygons(storage, run)
+    storage.select('wMain', [1, 2])
+    run.incrementalMode = True
+    run.deleteMerged = True
+    run.messages = RecordedMessages()
+
+    dissolvedRows = AsBuilt_Stages.createBuffers(run, ['wMain'])
+    newPolygons = AsBuilt_Stages.addNewPolygons(run, dissolvedRows, 'Asbuilt_Polygons')
+
+    rows = storage.connection.execute("SELECT OBJECTID FROM Asbuilt_Polygons").fetchall()
+    assert rows == [(1,)]
+    assert [oid for oid, globalId in newPolygons] == [1]
+    assert run.messages.warnings == ["Deleting as-built polygon(s) 2, merged into the polygon(s) 1 with their "
+                                     "attachments."]
+
+
+def test_incremental_run_keeps_the_other_polygons_by_default(storage, run, source):
+    run.setInputs(source, '01/31/2024', 'WUD-1')
+    insertEarlierPolygons(storage, run)
+    storage.select('wMain', [1, 2])
+    run.incrementalMode = True
+    run.messages = RecordedMessages()
+
+    dissolvedRows = AsBuilt_Stages.createBuffers(run, ['wMain'])
+    AsBuilt_Stages.addNewPolygons(run, dissolvedRows, 'Asbuilt_Polygons')
+
+    assert storage.connection.execute("SELECT OBJECTID FROM Asbuilt_Polygons").fetchall() == [(1,), (2,)]
+    assert '2' in run.messages.warnings[0] and 'left as they are' in run.messages.warnings[0]
+
+
+def test_corrective_re_run_updates_the_date_and_project_number(storage, run, source):
+    storage.select('wMain', [1, 2])
+    run.setInputs(source, '01/31/2024', 'WUD-1')
+    AsBuilt_Stages.runStages(run, ['wMain'], 'Asbuilt_Polygons', addAttach=0)
+
+    run.incrementalMode = True
+    run.setInputs(source, '02/15/2024', 'WUD-2')
+    AsBuilt_Stages.runStages(run, ['wMain'], 'Asbuilt_Polygons', addAttach=0)
+
+    assert storage.connection.execute("SELECT DISTINCT ASBUILTDATE FROM wMain WHERE OBJECTID IN (1, 2)").fetchall() \
+        == [('02/15/2024',)]
+    assert storage.connection.execute("SELECT ASBUILTDATE, WUDPROJECTNUM FROM Asbuilt_Polygons").fetchall() == \
+        [('02/15/2024', 'WUD-2')]
+
+
+# return the DISSOLVE_FIELDS values createBuffers gives the run's as-built
+def polygonValues(run):
+    values = {field: 'No' for field in AsBuilt_Engine.DISSOLVE_FIELDS}
+    values.update(PBCWUDFILE=run.pbcwudfile, HYPERLINK=run.hyperlink, P56FOLDER='P56', ASBUILTNO='1234567',
+                  ASBUILTDATE=run.asbuiltDate, WUDPROJECTNUM=run.asbuiltWUDNUM, WATER='Yes')
+    return values
+
+
+class RecordedMessages:
+
+    def __init__(self):
+        self.messages = []
+        self.warnings = []
+
+    def AddMessage(self, message):
+        self.messages.append(message)
+
+    def AddWarning(self, message):
+        self.warnings.append(message)
+
+
+def test_empty_buffers_are_dropped_before_the_dissolve(storage, run, source):
+    # A zero-length main has no sides to buffer with flat caps
+    with storage.editor(storage.path):
+        with storage.insertCursor('wMain', ['SHAPE@WKB', 'WATERTYPE']) as cursor:
+            cursor.insertRow([shapely.LineString([(2000, 0), (2000, 0)]).wkb, 'Potable'])
+    run.messages = RecordedMessages()
+    run.bufferStyle = {'quad_segs': 16, 'cap_style': 'flat', 'join_style': 'round'}
+    run.setInputs(source, '01/31/2024', '')
+    storage.select('wMain', [1, 4])
+
+    dissolvedRows = AsBuilt_Stages.createBuffers(run, ['wMain'])
+
+    assert len(dissolvedRows) == 1
+    assert dissolvedRows[0]['SHAPE@'].equals(shapely.box(0, -10, 100, 10))
+    assert run.messages.warnings == ["1 selected feature(s) gave an empty buffer and were left out."]
+
+
+def test_same_as_built_date_compares_dates_with_the_entered_text():
+    # arcpy reads date fields as datetime, the tool parameter is text
+    assert AsBuilt_Stages.sameAsBuiltDate(datetime.datetime(2024, 1, 31), '01/31/2024')
+    assert AsBuilt_Stages.sameAsBuiltDate(datetime.date(2024, 1, 31), '2024-01-31')
+    assert not AsBuilt_Stages.sameAsBuiltDate(datetime.datetime(2024, 1, 30), '01/31/2024')
+    assert not AsBuilt_Stages.sameAsBuiltDate(datetime.datetime(2024, 1, 31), 'not a date')
+
+
+def test_date_picked_with_a_time_of_day_matches_through_set_inputs(run, source):
+    # setInputs keeps the date part of the parameter text, the time the calendar adds never reaches the comparison
+    run.setInputs(source, '1/31/2024 12:00:00 AM', '')
+    assert run.asbuiltDate == '1/31/2024'
+    assert AsBuilt_Stages.sameAsBuiltDate(datetime.datetime(2024, 1, 31), run.asbuiltDate)
+    assert not AsBuilt_Stages.sameAsBuiltDate(datetime.datetime(2024, 2, 1), run.asbuiltDate)
+
+
+def test_same_as_built_date_with_text_and_empty_values():
+    # GeoPackage keeps the date as text
+    assert AsBuilt_Stages.sameAsBuiltDate('01/31/2024', '01/31/2024')
+    assert not AsBuilt_Stages.sameAsBuiltDate('01/30/2024', '01/31/2024')
+    assert AsBuilt_Stages.sameAsBuiltDate(None, None)
+    assert not AsBuilt_Stages.sameAsBuiltDate(None, '01/31/2024')
+    assert not AsBuilt_Stages.sameAsBuiltDate(datetime.datetime(2024, 1, 31), None)
+
+
+def test_re_run_skips_an_attachment_that_is_already_there(storage, run, source):
+    storage.select('wMain', [1])
+    run.setInputs(source, '01/31/2024', '')
+    progress = AsBuilt_Stages.runStages(run, ['wMain'], 'Asbuilt_Polygons', addAttach=1)
+    run.messages = RecordedMessages()
+
+    AsBuilt_Stages.addAttachment(run, 'Asbuilt_Polygons', progress['newPolygons'])
+
+    assert storage.connection.execute("SELECT COUNT(*) FROM Asbuilt_Polygons__ATTACH").fetchone()[0] == 1
+    assert any('already attached' in message for message in run.messages.messages)
+
+
+def test_changed_scan_of_the_same_size_is_attached_again(storage, run, source):
+    storage.select('wMain', [1])
+    run.setInputs(source, '01/31/2024', '')
+    progress = AsBuilt_Stages.runStages(run, ['wMain'], 'Asbuilt_Polygons', addAttach=1)
+    with open(source, 'rb') as scan:
+        content = scan.read()
+    with open(source, 'wb') as scan:
+        scan.write(content[::-1])
+
+    AsBuilt_Stages.addAttachment(run, 'Asbuilt_Polygons', progress['newPolygons'])
+
+    stored = storage.connection.execute("SELECT DATA FROM Asbuilt_Polygons__ATTACH ORDER BY OBJECTID").fetchall()
+    assert [bytes(data) for (data,) in stored] == [content, content[::-1]]
@@ -0,0 +1,51 @@
+import sqlite3
+
+import AsBuilt_Storage
+
+
+def test_compress_oids_keeps_runs_as_ranges():
+    ranges, singles = AsBuilt_Storage.compressOids([7, 1, 2, 3, 4, 10, 11, 3, 20, 21, 22])
+    assert ranges == [(1, 4), (20, 22)]
+    assert singles == [7, 10, 11]
+
+
+def test_compress_oids_accepts_selection_strings():
+    # Describe.FIDSet hands the OIDs over as text
+    assert AsBuilt_Storage.compressOids('5;6;7;9'.split(';')) == ([(5, 7)], [9])
+
+
+def test_where_clauses_select_exactly_the_oids():
+    oids = list(range(1, 6)) + [8, 13] + list(range(100, 103))
+    clauses = AsBuilt_Storage.oidWhereClauses(oids, 'OID')
+    assert clauses == ["(OID >= 1 AND OID <= 5) OR (OID >= 100 AND OID <= 102)", "OID IN (8,13)"]
+
+    connection = sqlite3.connect(':memory:')
+    connection.execute("CREATE TABLE features (OID INTEGER PRIMARY KEY)")
+    connection.executemany("INSERT INTO features VALUES (?)", [(oid,) for oid in range(200)])
+    selected = [oid for clause in clauses for (oid,) in connection.execute(f"SELECT OID FROM features WHERE {clause}")]
+    assert sorted(selected) == oids
+
+
+def test_where_clauses_split_long_lists():
+    # Every other OID, so nothing compresses into a range
+    oids = list(range(0, 2 * (AsBuilt_Storage.IN_LIST_MAX + 10), 2))
+    clauses = AsBuilt_Storage.oidWhereClauses(oids)
+    assert len(clauses) == 2
+    assert clauses[0].count(',') == AsBuilt_Storage.IN_LIST_MAX - 1
+
+    ranges = [oid for start in range(0, 10 * (AsBuilt_Storage.RANGES_PER_CLAUSE + 1), 10)
+              for oid in range(start, start + AsBuilt_Storage.RANGE_MIN)]
+    assert len(AsBuilt_Storage.oidWhereClauses(ranges)) == 2
+
+
+def test_where_clauses_for_no_oids_and_large_selections():
+    assert AsBuilt_Storage.oidWhereClauses([]) == []
+    oids = range(AsBuilt_Storage.SELECTION_CURSOR_MIN)
+    assert AsBuilt_Storage.oidWhereClauses(list(oids), honorSelection=True) == [None]
+    assert AsBuilt_Storage.oidWhereClauses(list(oids)) == ["(OBJECTID >= 0 AND OBJECTID <= 49999)"]
+
+
+def test_where_clauses_select_on_geopackage(storage):
+    clauses = AsBuilt_Storage.oidWhereClauses([1, 3])
+    with storage.searchCursor('wMain', ['OID@'], clauses[0]) as cursor:
+        assert [row[0] for row in cursor] == [1, 3]
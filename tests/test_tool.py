@@ -0,0 +1,109 @@
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+import AsBuilt_Polygons_Tool_wAttachments as tool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_worker_import_of_the_tool_script_skips_arcpy():
+    # A spawned pool worker runs the tool script again as __mp_main__, that must not import arcpy
+    code = ("import runpy, sys; runpy.run_path('AsBuilt_Polygons_Tool_wAttachments.py', run_name='__mp_main__'); "
+            "print('arcpy' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == 'False'
+
+PRODUCTION_FIELDS = ['OBJECTID', 'SHAPE', 'SOURCE', 'ASBUILTDATE', 'WATERTYPE']
+
+
+class StubLayer:
+    # The parts of arcpy.mp.Layer the layer scan reads
+
+    def __init__(self, name, fields, selection=()):
+        self.longName = name
+        self.dataSource = f'C:\\Connections\\wud.sde\\WUD.WaterDistribution\\{name}'
+        self.fields = fields
+        self.selection = list(selection)
+        self.visible = True
+        self.isGroupLayer = False
+        self.isFeatureLayer = True
+
+    def supports(self, property):
+        return property == 'DATASOURCE'
+
+    def getSelectionSet(self):
+        return self.selection
+
+
+class StubArcpy:
+    # Counts the ListFields calls per layer, the workspace is a named version
+
+    def __init__(self):
+        self.listFieldsCalls = []
+        self.messages = []
+
+    def ListFields(self, lyr):
+        self.listFieldsCalls.append(lyr.longName)
+        return [types.SimpleNamespace(name=field) for field in lyr.fields]
+
+    def Describe(self, path):
+        return types.SimpleNamespace(connectionProperties=types.SimpleNamespace(version='WUD.Edits'))
+
+    def AddMessage(self, message):
+        self.messages.append(str(message))
+
+
+@pytest.fixture
+def stubArcpy(monkeypatch):
+    stub = StubArcpy()
+    monkeypatch.setattr(tool, 'arcpy', stub)
+    monkeypatch.setattr(tool, 'layerEligibility', {})
+    monkeypatch.setattr(tool, 'verifiedPaths', set())
+    monkeypatch.setattr(tool, 'workspaceVersions', {})
+    return stub
+
+
+# return the layerEligibility entry the cache file would hold for a layer
+def cachedEntry(lyr, fields, eligible):
+    return {str(tool.layerCatalogPath(lyr).lower()): {'fields': tool.fieldsFingerprint(fields), 'eligible': eligible}}
+
+
+def test_unselected_cached_layer_is_a_cache_hit(stubArcpy, monkeypatch):
+    wMain = StubLayer('wMain', PRODUCTION_FIELDS, selection=[1])
+    wValve = StubLayer('wValve', PRODUCTION_FIELDS)
+    tool.layerEligibility.update(cachedEntry(wValve, PRODUCTION_FIELDS, True))
+    monkeypatch.setattr(tool, 'lyrList', [wMain, wValve], raising=False)
+
+    assert tool.checkFeatureSelection() == [wMain]
+    assert stubArcpy.listFieldsCalls == ['wMain']
+    # ListFields on wMain and Describe of the workspace, wValve's fields and the second workspace lookup are avoided
+    assert tool.scanStats == {'describeCalls': 2, 'describeAvoided': 2}
+
+
+def test_selected_layer_cached_as_ineligible_is_checked_again(stubArcpy, monkeypatch):
+    wMain = StubLayer('wMain', PRODUCTION_FIELDS, selection=[1])
+    tool.layerEligibility.update(cachedEntry(wMain, ['OBJECTID', 'SHAPE'], False))
+    monkeypatch.setattr(tool, 'lyrList', [wMain], raising=False)
+
+    assert tool.checkFeatureSelection() == [wMain]
+    assert stubArcpy.listFieldsCalls == ['wMain']
+    assert tool.scanStats == {'describeCalls': 2, 'describeAvoided': 0}
+    assert any('fields of \'wMain\' changed' in message for message in stubArcpy.messages)
+
+
+def test_selected_layer_whose_fields_changed_is_dropped(stubArcpy, monkeypatch):
+    # Cached as eligible, WATERTYPE has since been dropped from wMain
+    wMain = StubLayer('wMain', ['OBJECTID', 'SHAPE', 'SOURCE', 'ASBUILTDATE'], selection=[1])
+    wValve = StubLayer('wValve', PRODUCTION_FIELDS, selection=[7])
+    tool.layerEligibility.update(cachedEntry(wMain, PRODUCTION_FIELDS, True))
+    monkeypatch.setattr(tool, 'lyrList', [wMain, wValve], raising=False)
+
+    assert tool.checkFeatureSelection() == [wValve]
+    assert stubArcpy.listFieldsCalls == ['wValve', 'wMain']
+    # The cache hit on wMain turned into a ListFields call when it was verified
+    assert tool.scanStats == {'describeCalls': 3, 'describeAvoided': 1}
+    assert tool.layerEligibility[str(wMain.dataSource.lower())]['eligible'] is False